@@ -1,991 +1,1912 @@
-import os
-import csv
-import json
-import io
-import zipfile
-import datetime
-import pandas as pd
-import traceback # For detailed error logging
-import shutil # For copying files to template library
-from flask import (
-    Flask, render_template, request, send_from_directory,
-    flash, redirect, url_for, send_file
-)
-from werkzeug.utils import secure_filename
-from docx import Document
-from docx.shared import Pt # Optional: Could be used for advanced formatting if needed
-
-# --- DOCX2PDF Import and Availability Check ---
-try:
-    from docx2pdf import convert as docx_to_pdf_convert
-    DOCX2PDF_AVAILABLE = True
-    print("✅ docx2pdf library found and imported successfully.")
-except ImportError:
-    print("⚠️ WARNING: `docx2pdf` library not found. PDF generation will be disabled.")
-    DOCX2PDF_AVAILABLE = False
-    docx_to_pdf_convert = None # Define as None for graceful checks later
-except Exception as import_err:
-    print(f"⚠️ WARNING: Error importing `docx2pdf`: {import_err}. PDF generation might fail.")
-    DOCX2PDF_AVAILABLE = False
-    docx_to_pdf_convert = None
-
-# === Flask App Setup ===
-app = Flask(__name__)
-app.secret_key = os.environ.get("FLASK_SECRET_KEY", os.urandom(24))
-
-# === Configuration ===
-BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-UPLOAD_FOLDER = os.path.join(BASE_DIR, 'temp_uploads') # For temporary storage before processing
-GENERATED_FOLDER = os.path.join(BASE_DIR, 'generated_files') # Where final DOCX/PDFs are saved
-TEMPLATES_FOLDER = os.path.join(BASE_DIR, 'user_templates') # For persistent user templates
-ALLOWED_EXTENSIONS_DOCX = {'docx'}
-ALLOWED_EXTENSIONS_DATA = {'csv', 'json'}
-
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['GENERATED_FOLDER'] = GENERATED_FOLDER
-app.config['TEMPLATES_FOLDER'] = TEMPLATES_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024 # 32 MB Upload limit
-
-# Ensure necessary folders exist with write permissions
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(GENERATED_FOLDER, exist_ok=True)
-os.makedirs(TEMPLATES_FOLDER, exist_ok=True)
-
-# === Helper Functions ===
-
-def allowed_file(filename, allowed_extensions):
-    """Checks if a filename has an allowed extension (case-insensitive)."""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in allowed_extensions
-
-def replace_text_in_runs(paragraphs, data):
-    """Replaces placeholders {key} with value from data dict in paragraph runs."""
-    replacements = 0
-    if not data: # Skip if data is empty
-        return 0
-    # Ensure all placeholders are strings (even if they look like {numbers})
-    placeholders_map = {str(k): str(v) if v is not None else '' for k, v in data.items()}
-    placeholders = list(placeholders_map.keys()) # Get keys once
-
-    for paragraph in paragraphs:
-        full_text = "".join(run.text for run in paragraph.runs)
-        if not any(ph in full_text for ph in placeholders):
-            continue
-        for run in paragraph.runs:
-            if not any(ph_part in run.text for ph in placeholders for ph_part in ['{','}']):
-                 continue
-            original_run_text = run.text
-            modified_run_text = original_run_text
-            for placeholder, value in placeholders_map.items():
-                 modified_run_text = modified_run_text.replace(placeholder, value)
-            if original_run_text != modified_run_text:
-                run.text = modified_run_text
-                replacements += 1
-    return replacements
-
-def safe_cleanup(filepath):
-    """Attempts to remove a file, logging errors but not crashing."""
-    if filepath and os.path.exists(filepath):
-        try:
-            os.remove(filepath)
-            print(f"DEBUG: Cleaned up temporary file: {filepath}")
-        except OSError as e:
-            print(f"Warning: Could not remove temporary file {filepath}: {e}")
-
-def list_user_templates():
-    """Lists .docx templates from the TEMPLATES_FOLDER."""
-    if not os.path.exists(app.config['TEMPLATES_FOLDER']):
-        return []
-    templates = [f for f in os.listdir(app.config['TEMPLATES_FOLDER']) if f.lower().endswith('.docx')]
-    return sorted(templates)
-
-# === Core Generation Logic Functions ===
-
-def generate_document_core(template_path, data, filename_prefix, filename_suffix):
-    """
-    Core logic to generate a DOCX and optionally PDF from a template.
-    """
-    print(f"DEBUG: Generating '{filename_prefix}' for suffix: {filename_suffix}")
-    docx_filename = f"{filename_prefix}_{filename_suffix}.docx"
-    docx_save_path = os.path.join(app.config['GENERATED_FOLDER'], docx_filename)
-    pdf_filename = f"{filename_prefix}_{filename_suffix}.pdf"
-    pdf_save_path = os.path.join(app.config['GENERATED_FOLDER'], pdf_filename)
-    pdf_final_path = None
-    error_message = None
-
-    try:
-        if not os.path.exists(template_path):
-            return False, None, None, f"Template file not found: '{template_path}'"
-        if not data or not isinstance(data, dict):
-            return False, None, None, "Invalid or missing data for document generation."
-
-        print(f"DEBUG: Loading template: {template_path}")
-        doc = Document(template_path)
-        total_replacements = 0
-        print(f"DEBUG: Replacing placeholders in {filename_prefix}...")
-        total_replacements += replace_text_in_runs(doc.paragraphs, data)
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells: total_replacements += replace_text_in_runs(cell.paragraphs, data)
-        for section in doc.sections:
-            for header in [section.header, section.first_page_header, section.even_page_header]:
-                if header is not None: total_replacements += replace_text_in_runs(header.paragraphs, data)
-            for footer in [section.footer, section.first_page_footer, section.even_page_footer]:
-                if footer is not None: total_replacements += replace_text_in_runs(footer.paragraphs, data)
-
-        if total_replacements == 0:
-            print(f"⚠️ Warning: No placeholders were replaced for '{filename_suffix}' ({filename_prefix}). Check template & data keys.")
-
-        print(f"DEBUG: Saving DOCX to: {docx_save_path}")
-        doc.save(docx_save_path)
-        if not os.path.exists(docx_save_path):
-            raise OSError(f"Failed to save DOCX file to '{docx_save_path}'")
-        print(f"✅ Generated DOCX: {docx_filename}")
-
-        pdf_specific_error = None
-        if DOCX2PDF_AVAILABLE and docx_to_pdf_convert:
-            print(f"DEBUG: Attempting PDF conversion: {docx_filename} -> {pdf_filename}")
-            try:
-                docx_to_pdf_convert(docx_save_path, pdf_save_path)
-                if os.path.exists(pdf_save_path):
-                    pdf_final_path = pdf_save_path
-                    print(f"✅ Generated PDF: {pdf_filename}")
-                else:
-                    pdf_specific_error = "PDF Conversion process completed, but the output file was not found."
-                    print(f"❌ {pdf_specific_error}")
-            except Exception as pdf_err:
-                 pdf_specific_error = f"PDF conversion failed: {str(pdf_err)}"
-                 print(f"❌ Error during PDF conversion for '{filename_suffix}': {pdf_err}")
-                 flash(f"Warning: PDF generation failed for {filename_suffix}. DOCX created. Error: {str(pdf_err)}", "warning")
-        else:
-             if DOCX2PDF_AVAILABLE and not docx_to_pdf_convert:
-                 print("ERROR: docx2pdf marked available but convert function missing.")
-                 pdf_specific_error = "PDF conversion function unavailable despite library import."
-             else:
-                print(f"DEBUG: PDF conversion skipped for {filename_suffix} (library/function not available).")
-
-        return True, docx_save_path, pdf_final_path, pdf_specific_error
-
-    except Exception as e:
-        error_message = f"Failed to generate {filename_prefix} for '{filename_suffix}': {str(e)}"
-        print(f"❌ {error_message}")
-        print(traceback.format_exc())
-        safe_cleanup(docx_save_path) # Cleanup partially generated docx
-        safe_cleanup(pdf_save_path) # Cleanup partially generated pdf
-        return False, None, None, error_message
-
-# Wrapper functions
-def generate_offer_letter_web(template_path, data, filename_suffix):
-     return generate_document_core(template_path, data, "Offer_Letter", filename_suffix)
-
-def generate_relieving_letter_web(template_path, data, filename_suffix):
-     return generate_document_core(template_path, data, "Relieving_Letter", filename_suffix)
-
-# === Flask Routes ===
-
-@app.context_processor
-def inject_global_vars():
-    return {
-        'current_year': datetime.datetime.now().year,
-        'user_templates': list_user_templates() # Make templates available to all renders
-    }
-
-@app.route('/')
-def index():
-    # Check if 'active_tab' is passed from a redirect and preserve it
-    active_tab = request.args.get('active_tab', None)
-    # Check if specific download info is passed and preserve it
-    letter_type = request.args.get('letter_type', None)
-    docx_download = request.args.get('docx_download', None)
-    pdf_download = request.args.get('pdf_download', None)
-    recipient_name = request.args.get('recipient_name', None)
-    converter_pdf_download = request.args.get('converter_pdf_download', None)
-    original_docx_filename = request.args.get('original_docx_filename', None)
-
-    return render_template('index.html',
-                           active_tab=active_tab,
-                           letter_type=letter_type,
-                           docx_download=docx_download,
-                           pdf_download=pdf_download,
-                           recipient_name=recipient_name,
-                           converter_pdf_download=converter_pdf_download,
-                           original_docx_filename=original_docx_filename)
-
-
-# --- Template Management Routes ---
-@app.route('/upload_user_template', methods=['POST'])
-def handle_upload_user_template():
-    active_tab_anchor = 'manage-templates-content'
-    if 'user_template_file' not in request.files:
-        flash('No template file provided for library upload.', 'danger')
-        return redirect(url_for('index', active_tab=active_tab_anchor))
-    
-    file = request.files['user_template_file']
-    if file.filename == '':
-        flash('No file selected for library upload.', 'danger')
-        return redirect(url_for('index', active_tab=active_tab_anchor))
-
-    if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_DOCX):
-        filename = secure_filename(file.filename)
-        save_path = os.path.join(app.config['TEMPLATES_FOLDER'], filename)
-        
-        if os.path.exists(save_path) and not request.form.get('overwrite_template'):
-            flash(f"Template '{filename}' already exists. Check 'Overwrite' to replace it.", 'warning')
-            return redirect(url_for('index', active_tab=active_tab_anchor))
-            
-        try:
-            file.save(save_path)
-            flash(f"Template '{filename}' uploaded successfully to library.", 'success')
-        except Exception as e:
-            flash(f"Error uploading template '{filename}': {e}", 'danger')
-    else:
-        flash('Invalid file type. Only .docx templates are allowed.', 'danger')
-    return redirect(url_for('index', active_tab=active_tab_anchor))
-
-
-@app.route('/delete_user_template/<path:filename>', methods=['POST'])
-def handle_delete_user_template(filename):
-    active_tab_anchor = 'manage-templates-content'
-    safe_filename = secure_filename(filename)
-    if not safe_filename:
-        flash("Invalid template filename for deletion.", "danger")
-        return redirect(url_for('index', active_tab=active_tab_anchor))
-
-    template_path = os.path.join(app.config['TEMPLATES_FOLDER'], safe_filename)
-    if os.path.exists(template_path):
-        try:
-            os.remove(template_path)
-            flash(f"Template '{safe_filename}' deleted successfully.", 'success')
-        except Exception as e:
-            flash(f"Error deleting template '{safe_filename}': {e}", 'danger')
-    else:
-        flash(f"Template '{safe_filename}' not found for deletion.", 'warning')
-    return redirect(url_for('index', active_tab=active_tab_anchor))
-
-
-# --- Helper for processing template choice ---
-def process_template_input(letter_type_for_log="document"):
-    """
-    Processes template input from form (existing library template or new upload).
-    Returns (actual_template_path_to_use, temp_uploaded_path_for_cleanup_if_any)
-    Returns (None, None) on error and flashes messages.
-    """
-    template_choice = request.form.get('template_choice')
-    selected_template_filename = request.form.get('selected_template_filename')
-    save_to_library = request.form.get('save_uploaded_template_to_library') == 'on'
-    
-    actual_template_path = None
-    temp_uploaded_path = None
-
-    if template_choice == 'existing_template':
-        if not selected_template_filename:
-            flash('Please select an existing template from the library.', 'danger')
-            return None, None
-        
-        safe_selected_filename = secure_filename(os.path.basename(selected_template_filename))
-        if not safe_selected_filename: 
-            flash('Invalid selected template name.', 'danger')
-            return None, None
-
-        actual_template_path = os.path.join(app.config['TEMPLATES_FOLDER'], safe_selected_filename)
-        if not os.path.exists(actual_template_path):
-            flash(f'Selected library template "{safe_selected_filename}" not found.', 'danger')
-            return None, None
-        print(f"DEBUG: Using existing template: {actual_template_path}")
-
-    elif template_choice == 'upload_new_template':
-        if 'template_file' not in request.files or not request.files['template_file'].filename:
-            flash(f'No template file provided for new upload ({letter_type_for_log}).', 'danger')
-            return None, None
-        
-        template_file = request.files['template_file']
-        if not allowed_file(template_file.filename, ALLOWED_EXTENSIONS_DOCX):
-            flash(f'Invalid template file type for {letter_type_for_log} (.docx required).', 'danger')
-            return None, None
-
-        original_filename = secure_filename(template_file.filename)
-        timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
-        
-        temp_filename_for_processing = f"runtime_upload_{letter_type_for_log}_{timestamp}_{original_filename}"
-        temp_uploaded_path = os.path.join(app.config['UPLOAD_FOLDER'], temp_filename_for_processing)
-        
-        try:
-            template_file.save(temp_uploaded_path)
-            actual_template_path = temp_uploaded_path 
-            print(f"DEBUG: Saved temporary uploaded template: {temp_uploaded_path}")
-        except Exception as e:
-            flash(f"Error saving temporary template: {e}", "danger")
-            safe_cleanup(temp_uploaded_path)
-            return None, None
-
-        if save_to_library:
-            library_path = os.path.join(app.config['TEMPLATES_FOLDER'], original_filename)
-            try:
-                if os.path.exists(library_path) and not request.form.get('overwrite_if_exists_in_library_from_form'): 
-                     flash(f"Template '{original_filename}' already exists in library. Not overwritten from this form. Use 'Manage Templates' to explicitly overwrite.", 'warning')
-                else:
-                    shutil.copy(temp_uploaded_path, library_path)
-                    flash(f"Template '{original_filename}' saved to library.", "info")
-                    app.jinja_env.globals.update(user_templates=list_user_templates())
-            except Exception as e:
-                flash(f"Could not save uploaded template '{original_filename}' to library: {e}", "warning")
-    else:
-        flash('Invalid template choice. Please select or upload a template.', 'danger')
-        return None, None
-        
-    return actual_template_path, temp_uploaded_path
-
-
-# --- Single Generation Routes ---
-@app.route('/generate_single_offer', methods=['POST'])
-def handle_generate_single_offer():
-    letter_type = 'offer'
-    uploaded_temp_template_path_for_cleanup = None
-    recipient_name_field = 'candidate name' # This is the HTML form field name
-    
-    # *** CORRECTED KEYS TO MATCH HTML UNDERSCORE CONVENTION WHERE APPLICABLE ***
-    form_to_placeholder = {
-        "send_date": "{send date}", "candidate name": "{candidate name}", "designation": "{designation}",
-        "fdesignation": "{fdesignation}", "email": "{email}", 
-        "mobile_number": "{mobile number}",  # Expects HTML name="mobile_number"
-        "dear_name": "{dear name}",          # Expects HTML name="dear_name"
-        "joining_date": "{joining date}", "hr_name": "{hr name}", "lpa": "{lpa}"
-    }
-    # The field used for filename suffix and display messages
-    # This assumes 'candidate name' (with space) is correctly mapped if `recipient_name_field` is 'candidate name'
-    recipient_name_from_form = request.form.get(recipient_name_field, f'Unknown_{letter_type}_Recipient').strip()
-    success_flag = False 
-    active_tab_anchor = f'{letter_type}-single-content'
-    
-    try:
-        actual_template_to_use, uploaded_temp_template_path_for_cleanup = process_template_input(letter_type)
-        if not actual_template_to_use:
-            return redirect(url_for('index', active_tab=active_tab_anchor))
-
-        form_data = {}
-        missing_fields = []
-        for field_key, placeholder in form_to_placeholder.items():
-            # `field_key` is what we use with request.form.get()
-            value = request.form.get(field_key, '').strip() 
-            is_required = field_key != "fdesignation" 
-            if not value and is_required:
-                missing_fields.append(f"'{field_key.replace('_', ' ')}'") # Make field name more readable for flash
-            form_data[placeholder] = value
-
-        if missing_fields:
-             flash(f"Missing required {letter_type} details: {', '.join(missing_fields)}.", 'danger')
-             raise ValueError("Missing fields")
-
-        name_suffix = recipient_name_from_form.replace(" ", "_").replace("/", "-").replace("\\", "-")
-        output_timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename_suffix = secure_filename(f"single_{letter_type}_{name_suffix}_{output_timestamp}")
-
-        print(f"--- Generating Single {letter_type.capitalize()}: {recipient_name_from_form} ---")
-        gen_success, docx_path, pdf_path, error_msg = generate_offer_letter_web(
-             actual_template_to_use, form_data, filename_suffix
-        )
-
-        if gen_success:
-            success_flag = True
-            flash(f"Successfully generated {letter_type} document(s) for {recipient_name_from_form}.", 'success')
-            final_docx = os.path.basename(docx_path) if docx_path and os.path.exists(docx_path) else None
-            final_pdf = os.path.basename(pdf_path) if pdf_path and os.path.exists(pdf_path) else None
-            if not final_docx:
-                 flash("Internal Error: Generated DOCX file not found.", "danger")
-                 return redirect(url_for('index', active_tab=active_tab_anchor))
-            # Pass results back to index page via query parameters for display
-            return redirect(url_for('index', 
-                                   letter_type=letter_type,
-                                   docx_download=final_docx,
-                                   pdf_download=final_pdf,
-                                   recipient_name=recipient_name_from_form,
-                                   active_tab=active_tab_anchor))
-        else:
-            flash(f"Error generating {letter_type} letter for {recipient_name_from_form}: {error_msg}", 'danger')
-            return redirect(url_for('index', active_tab=active_tab_anchor))
-
-    except ValueError: 
-        pass 
-    except Exception as route_err:
-        print(f"CRITICAL Route Error in /generate_single_{letter_type}: {route_err}\n{traceback.format_exc()}")
-        flash(f"Unexpected server error during single {letter_type} generation.", "danger")
-    finally:
-        safe_cleanup(uploaded_temp_template_path_for_cleanup)
-        if not success_flag: 
-             return redirect(url_for('index', active_tab=active_tab_anchor))
-
-
-@app.route('/generate_single_relieving', methods=['POST'])
-def handle_generate_single_relieving():
-    letter_type = 'relieving'
-    uploaded_temp_template_path_for_cleanup = None
-    recipient_name_field = 'name' # HTML form field name
-    form_to_placeholder = { # Keys are HTML form field names
-        "send_date": "{send date}", "name": "{name}", "role": "{role}",
-        "working_date": "{working date}", "accepted_date": "{accepted date}",
-        "relieved_date": "{relieved date}", "hr_name": "{hr name}"
-    }
-    recipient_name_from_form = request.form.get(recipient_name_field, f'Unknown_{letter_type}_Recipient').strip()
-    success_flag = False
-    active_tab_anchor = f'{letter_type}-single-content'
-    try:
-        actual_template_to_use, uploaded_temp_template_path_for_cleanup = process_template_input(letter_type)
-        if not actual_template_to_use:
-            return redirect(url_for('index', active_tab=active_tab_anchor))
-
-        form_data = {}
-        missing_fields = []
-        for field_key, placeholder in form_to_placeholder.items():
-             value = request.form.get(field_key, '').strip()
-             if not value: 
-                  missing_fields.append(f"'{field_key.replace('_', ' ')}'")
-             form_data[placeholder] = value
-        if missing_fields:
-             flash(f"Missing required {letter_type} details: {', '.join(missing_fields)}.", 'danger'); raise ValueError("Missing fields")
-
-        name_suffix = recipient_name_from_form.replace(" ", "_").replace("/", "-").replace("\\", "-")
-        output_timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename_suffix = secure_filename(f"single_{letter_type}_{name_suffix}_{output_timestamp}")
-
-        print(f"--- Generating Single {letter_type.capitalize()}: {recipient_name_from_form} ---")
-        gen_success, docx_path, pdf_path, error_msg = generate_relieving_letter_web(
-             actual_template_to_use, form_data, filename_suffix
-        )
-
-        if gen_success:
-            success_flag = True
-            flash(f"Successfully generated {letter_type} document(s) for {recipient_name_from_form}.", 'success')
-            final_docx = os.path.basename(docx_path) if docx_path and os.path.exists(docx_path) else None
-            final_pdf = os.path.basename(pdf_path) if pdf_path and os.path.exists(pdf_path) else None
-            if not final_docx: flash("Internal Error: Generated DOCX file not found.", "danger"); return redirect(url_for('index', active_tab=active_tab_anchor))
-            return redirect(url_for('index', 
-                                   letter_type=letter_type, 
-                                   docx_download=final_docx, 
-                                   pdf_download=final_pdf, 
-                                   recipient_name=recipient_name_from_form, 
-                                   active_tab=active_tab_anchor))
-        else: 
-            flash(f"Error generating {letter_type} letter for {recipient_name_from_form}: {error_msg}", 'danger')
-            return redirect(url_for('index', active_tab=active_tab_anchor))
-
-    except ValueError:
-        pass
-    except Exception as route_err:
-         print(f"CRITICAL Route Error in /generate_single_{letter_type}: {route_err}\n{traceback.format_exc()}"); flash(f"Unexpected server error during single {letter_type} generation.", "danger")
-    finally:
-        safe_cleanup(uploaded_temp_template_path_for_cleanup)
-        if not success_flag:
-             return redirect(url_for('index', active_tab=active_tab_anchor))
-
-
-# --- Bulk Generation Routes ---
-
-@app.route('/generate_bulk_manual_offer', methods=['POST'])
-def handle_generate_bulk_manual_offer():
-    letter_type = 'offer'
-    uploaded_temp_template_path_for_cleanup = None
-    zip_buffer = None 
-    output_format = request.form.get('output_format', 'both')
-    # Keys are HTML form field names (generated by JS with underscores)
-    form_to_placeholder = {
-        "candidate_name": "{candidate name}", "send_date": "{send date}", "designation": "{designation}",
-        "fdesignation": "{fdesignation}", "email": "{email}", "mobile_number": "{mobile number}",
-        "dear_name": "{dear name}", "joining_date": "{joining date}", "hr_name": "{hr name}", "lpa": "{lpa}"
-    }
-    required_fields = ['candidate_name', 'send_date', 'designation', 'email', 'mobile_number', 'dear_name', 'joining_date', 'hr_name', 'lpa'] # These are the form field name keys
-    name_field_key = 'candidate_name' # This is a form field name key
-    active_tab_anchor = 'offer-manual-content'
-
-    try:
-        actual_template_to_use, uploaded_temp_template_path_for_cleanup = process_template_input(f"manual_bulk_{letter_type}")
-        if not actual_template_to_use:
-            return redirect(url_for('index', active_tab=active_tab_anchor))
-
-        form_lists = { name_key: request.form.getlist(name_key) for name_key in form_to_placeholder.keys() }
-        num_entries = len(form_lists.get(name_field_key, [])) 
-
-        if num_entries == 0: flash("No entry details submitted for manual bulk offer.", "warning"); raise ValueError("No entries")
-
-        for field_name_check in form_to_placeholder.keys(): 
-            if len(form_lists.get(field_name_check,[])) != num_entries:
-                 flash(f"Data mismatch: Inconsistent number of entries for field '{field_name_check.replace('_', ' ')}'. Expected {num_entries}, got {len(form_lists.get(field_name_check,[]))}.", "danger")
-                 raise ValueError("List length mismatch")
-        print(f"DEBUG: Processing {num_entries} manually entered {letter_type} letters.")
-
-        generated_files_paths = []; generation_errors = []; pdf_failures = 0; successful_records_count = 0;
-        if output_format in ['pdf', 'both'] and not DOCX2PDF_AVAILABLE: flash("PDF conversion unavailable.", "warning")
-
-        for i in range(num_entries):
-            current_data_for_template = {} 
-            current_missing_fields_keys = []
-            recipient_name = form_lists[name_field_key][i].strip() 
-
-            for field_key, placeholder in form_to_placeholder.items():
-                value = form_lists[field_key][i].strip()
-                current_data_for_template[placeholder] = value
-                # fdesignation is optional (not in required_fields)
-                is_required = field_key in required_fields and field_key != "fdesignation"
-                if is_required and not value:
-                    current_missing_fields_keys.append(f"'{field_key.replace('_', ' ')}'")
-            
-            # Special check for fdesignation if it IS in required_fields (it's not here, but good practice)
-            if "fdesignation" in required_fields and not form_lists["fdesignation"][i].strip():
-                current_missing_fields_keys.append("'fdesignation'")
-
-
-            if not recipient_name:
-                 err_msg = f"Manual {letter_type.capitalize()} Entry {i+1}: Skipping (Missing '{name_field_key.replace('_', ' ')}')"; print(f"Warning:{err_msg}"); generation_errors.append(err_msg); continue
-            if current_missing_fields_keys:
-                 err_msg = f"Manual {letter_type.capitalize()} Entry {i+1} ('{recipient_name}'): Missing fields: {', '.join(current_missing_fields_keys)}"; print(f"Warning:{err_msg}"); generation_errors.append(err_msg); continue
-
-            name_suffix = recipient_name.replace(" ", "_").replace("/", "-").replace("\\", "-"); out_ts = datetime.datetime.now().strftime('%H%M%S%f')
-            filename_suffix = secure_filename(f"manual_{letter_type}_{i+1}_{name_suffix}_{out_ts}")
-            print(f"--- Processing Manual {letter_type.capitalize()} ({i+1}/{num_entries}): {recipient_name} ---")
-            gen_success, docx_path, pdf_path, pdf_err_msg = generate_offer_letter_web(actual_template_to_use, current_data_for_template, filename_suffix)
-
-            added_files_for_record = False
-            if gen_success:
-                 if output_format in ['docx', 'both'] and docx_path and os.path.exists(docx_path): generated_files_paths.append(docx_path); added_files_for_record = True
-                 if output_format in ['pdf', 'both']:
-                     if pdf_path and os.path.exists(pdf_path):
-                         generated_files_paths.append(pdf_path); added_files_for_record = True
-                     else:
-                         pdf_failures += 1 
-                         if pdf_err_msg: print(f"DEBUG: PDF failure reason for '{recipient_name}': {pdf_err_msg}")
-                 if added_files_for_record:
-                     successful_records_count += 1
-                 else:
-                     err = f"'{recipient_name}' (Manual {letter_type.capitalize()}): DOCX generated but no requested output format found/saved."
-                     generation_errors.append(err); print(f"Warning: {err}") 
-            else:
-                fail_reason = pdf_err_msg or 'Generation core function returned False.'
-                generation_errors.append(f"'{recipient_name}' (Manual {letter_type.capitalize()}): Generation failed ({fail_reason})")
-
-        print(f"DEBUG: Manual bulk {letter_type} finished. Success: {successful_records_count}/{num_entries}")
-        if successful_records_count == 0:
-             flash(f"No {letter_type} letters generated successfully from manual entries.", "danger");
-             if generation_errors: flash("Errors: " + "; ".join(generation_errors), "warning");
-             raise ValueError("No successful generation")
-
-        zip_buffer = io.BytesIO(); print(f"DEBUG: Creating Manual {letter_type.capitalize()} ZIP ({output_format})...");
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-             for file_path in generated_files_paths:
-                 if os.path.exists(file_path): zipf.write(file_path, os.path.basename(file_path))
-                 else: print(f"Warning: File path listed for zipping but not found: {file_path}") 
-
-        zip_buffer.seek(0); success_msg = f"Generated documents for {successful_records_count}/{num_entries} manual {letter_type} entries (Format: {output_format.upper()})."; flash(success_msg, 'success')
-        if generation_errors: flash("Issues: " + "; ".join(generation_errors), 'warning')
-        if pdf_failures > 0 and output_format != 'docx': flash(f"Note: PDF failed/skipped for {pdf_failures} entries.", 'info')
-        zip_filename_ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S"); zip_filename = f"Generated_Manual_Offers_{output_format.upper()}_{zip_filename_ts}.zip"
-        # Do not redirect here, send_file will be the response
-        return send_file( zip_buffer, mimetype='application/zip', as_attachment=True, download_name=zip_filename )
-
-    except ValueError: 
-        pass 
-    except Exception as route_err:
-        print(f"CRITICAL Error /generate_bulk_manual_{letter_type}: {route_err}\n{traceback.format_exc()}"); flash("Unexpected server error during manual bulk generation.", "danger")
-    finally:
-        safe_cleanup(uploaded_temp_template_path_for_cleanup)
-        if 'generated_files_paths' in locals() and zip_buffer: # Only cleanup if zip was created
-             for p_cleanup in generated_files_paths: safe_cleanup(p_cleanup)
-        
-        if 'zip_buffer' not in locals() or not zip_buffer: # Redirect if zip wasn't created/sent
-             return redirect(url_for('index', active_tab=active_tab_anchor))
-
-
-@app.route('/generate_bulk_manual_relieving', methods=['POST'])
-def handle_generate_bulk_manual_relieving():
-    letter_type = 'relieving'
-    uploaded_temp_template_path_for_cleanup = None
-    zip_buffer = None 
-    output_format = request.form.get('output_format', 'both')
-    # Keys are HTML form field names (generated by JS with underscores if applicable)
-    form_to_placeholder = {
-        "name": "{name}", "send_date": "{send date}", "role": "{role}",
-        "working_date": "{working date}", "accepted_date": "{accepted date}",
-        "relieved_date": "{relieved date}", "hr_name": "{hr name}"
-    }
-    required_fields_keys = list(form_to_placeholder.keys()) # All are required for relieving
-    name_field_key = 'name' # This is a form field name key
-    active_tab_anchor = 'relieving-manual-content'
-
-    try:
-        actual_template_to_use, uploaded_temp_template_path_for_cleanup = process_template_input(f"manual_bulk_{letter_type}")
-        if not actual_template_to_use:
-            return redirect(url_for('index', active_tab=active_tab_anchor))
-
-        form_lists = { name_key: request.form.getlist(name_key) for name_key in form_to_placeholder.keys() }
-        num_entries = len(form_lists.get(name_field_key, [])) 
-
-        if num_entries == 0: flash("No entry details submitted for manual bulk relieving.", "warning"); raise ValueError("No entries")
-
-        for field_name_check in form_to_placeholder.keys():
-            if len(form_lists.get(field_name_check,[])) != num_entries:
-                 flash(f"Data mismatch: Inconsistent number of entries for field '{field_name_check.replace('_', ' ')}'. Expected {num_entries}, got {len(form_lists[field_name_check])}.", "danger")
-                 raise ValueError("List length mismatch")
-
-        print(f"DEBUG: Processing {num_entries} manually entered {letter_type} letters.")
-
-        generated_files_paths = []; generation_errors = []; pdf_failures = 0; successful_records_count = 0;
-        if output_format in ['pdf', 'both'] and not DOCX2PDF_AVAILABLE: flash("PDF conversion unavailable.", "warning")
-
-        for i in range(num_entries):
-            current_data_for_template = {} 
-            current_missing_fields_keys = []
-            recipient_name = form_lists[name_field_key][i].strip() 
-
-            for field_key, placeholder in form_to_placeholder.items():
-                value = form_lists[field_key][i].strip()
-                current_data_for_template[placeholder] = value
-                if field_key in required_fields_keys and not value:
-                    current_missing_fields_keys.append(f"'{field_key.replace('_', ' ')}'")
-
-            if not recipient_name: 
-                 err_msg = f"Manual {letter_type.capitalize()} Entry {i+1}: Skipping (Missing '{name_field_key.replace('_', ' ')}')"; print(f"Warning:{err_msg}"); generation_errors.append(err_msg); continue
-            if current_missing_fields_keys:
-                 err_msg = f"Manual {letter_type.capitalize()} Entry {i+1} ('{recipient_name}'): Missing fields: {', '.join(current_missing_fields_keys)}"; print(f"Warning:{err_msg}"); generation_errors.append(err_msg); continue
-
-            name_suffix = recipient_name.replace(" ", "_").replace("/", "-").replace("\\", "-"); out_ts = datetime.datetime.now().strftime('%H%M%S%f')
-            filename_suffix = secure_filename(f"manual_{letter_type}_{i+1}_{name_suffix}_{out_ts}")
-            print(f"--- Processing Manual {letter_type.capitalize()} ({i+1}/{num_entries}): {recipient_name} ---")
-            gen_success, docx_path, pdf_path, pdf_err_msg = generate_relieving_letter_web(actual_template_to_use, current_data_for_template, filename_suffix)
-
-            added_files_for_record = False
-            if gen_success:
-                 if output_format in ['docx', 'both'] and docx_path and os.path.exists(docx_path): generated_files_paths.append(docx_path); added_files_for_record = True
-                 if output_format in ['pdf', 'both']:
-                     if pdf_path and os.path.exists(pdf_path):
-                         generated_files_paths.append(pdf_path); added_files_for_record = True
-                     else:
-                         pdf_failures += 1
-                         if pdf_err_msg: print(f"DEBUG: PDF failure reason for '{recipient_name}': {pdf_err_msg}")
-                 if added_files_for_record:
-                     successful_records_count += 1
-                 else:
-                     err = f"'{recipient_name}' (Manual {letter_type.capitalize()}): DOCX generated but no requested output format found/saved."
-                     generation_errors.append(err); print(f"Warning: {err}")
-            else:
-                fail_reason = pdf_err_msg or 'Generation core function returned False.'
-                generation_errors.append(f"'{recipient_name}' (Manual {letter_type.capitalize()}): Generation failed ({fail_reason})")
-
-        print(f"DEBUG: Manual bulk {letter_type} finished. Success: {successful_records_count}/{num_entries}")
-        if successful_records_count == 0:
-             flash(f"No {letter_type} letters generated successfully from manual entries.", "danger");
-             if generation_errors: flash("Errors: " + "; ".join(generation_errors), "warning");
-             raise ValueError("No successful generation")
-
-        zip_buffer = io.BytesIO(); print(f"DEBUG: Creating Manual {letter_type.capitalize()} ZIP ({output_format})...");
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-             for file_path in generated_files_paths:
-                 if os.path.exists(file_path): zipf.write(file_path, os.path.basename(file_path))
-                 else: print(f"Warning: File path listed for zipping but not found: {file_path}")
-
-        zip_buffer.seek(0); success_msg = f"Generated documents for {successful_records_count}/{num_entries} manual {letter_type} entries (Format: {output_format.upper()})."; flash(success_msg, 'success')
-        if generation_errors: flash("Issues: " + "; ".join(generation_errors), 'warning')
-        if pdf_failures > 0 and output_format != 'docx': flash(f"Note: PDF failed/skipped for {pdf_failures} entries.", 'info')
-        zip_filename_ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        zip_filename = f"Generated_Manual_Relieving_{output_format.upper()}_{zip_filename_ts}.zip"
-        return send_file( zip_buffer, mimetype='application/zip', as_attachment=True, download_name=zip_filename )
-
-    except ValueError:
-        pass
-    except Exception as route_err:
-        print(f"CRITICAL Error /generate_bulk_manual_{letter_type}: {route_err}\n{traceback.format_exc()}"); flash("Unexpected server error during manual bulk generation.", "danger")
-    finally:
-        safe_cleanup(uploaded_temp_template_path_for_cleanup)
-        if 'generated_files_paths' in locals() and zip_buffer: # Only cleanup if zip was created
-             for p_cleanup in generated_files_paths: safe_cleanup(p_cleanup)
-
-        if 'zip_buffer' not in locals() or not zip_buffer:
-             return redirect(url_for('index', active_tab=active_tab_anchor))
-
-
-# General Bulk Route (CSV/JSON for Offer/Relieving)
-@app.route('/generate_bulk', methods=['POST'])
-def handle_generate_bulk():
-    uploaded_temp_template_path_for_cleanup = None
-    data_path = None
-    zip_buf = None
-    letter_type = request.form.get('letter_type')
-    source_type = request.form.get('source_type')
-    output_format = request.form.get('output_format', 'both')
-    # Determine active tab before any potential errors
-    active_tab_anchor = f'{letter_type}-{source_type}-content' if letter_type and source_type else 'index'
-
-
-    try:
-        if not letter_type or letter_type not in ['offer', 'relieving']: flash('Invalid letter type selected.', 'danger'); raise ValueError("Invalid letter type")
-        if not source_type or source_type not in ['csv', 'json']: flash('Invalid data source type selected.', 'danger'); raise ValueError("Invalid source type")
-        if output_format not in ['both', 'docx', 'pdf']: flash('Invalid output format selected.', 'danger'); raise ValueError("Invalid output format")
-
-        actual_template_to_use, uploaded_temp_template_path_for_cleanup = process_template_input(f"bulk_{letter_type}_{source_type}")
-        if not actual_template_to_use: # process_template_input flashes its own errors
-            raise ValueError("Template processing failed") # Will be caught and redirected correctly
-
-        if 'data_file' not in request.files or not request.files['data_file'].filename:
-            flash(f'No data file provided for bulk {letter_type} ({source_type}).', 'danger')
-            raise ValueError("Missing data file")
-        
-        data_file = request.files['data_file']
-        if not allowed_file(data_file.filename, ALLOWED_EXTENSIONS_DATA):
-            flash(f'Invalid data file type for {source_type}.', 'danger')
-            raise ValueError("Invalid data file type")
-        
-        file_ext = data_file.filename.rsplit('.',1)[1].lower()
-        if file_ext != source_type:
-            flash(f'Data file extension ".{file_ext}" does not match selected source type ".{source_type}".', 'danger')
-            raise ValueError("Data file type mismatch")
-
-        # --- Determine Letter-Specific Settings (CSV/JSON headers vs placeholders) ---
-        # For CSV/JSON, the data file headers/keys become the *template placeholders* directly.
-        # The `name_key_in_data` is the specific header/key in the CSV/JSON that holds the recipient's name.
-        # The `name_ph_for_filename` is the *placeholder form* of that name key, used for messages/filenames if needed.
-        if letter_type == 'offer': 
-            name_key_in_data = 'candidate name' # Expected header in CSV/JSON for recipient's name
-            name_ph_for_filename = '{candidate name}' 
-            file_prefix = "Offer_Letter"
-            gen_func = generate_offer_letter_web
-        else: # relieving
-            name_key_in_data = 'name' # Expected header in CSV/JSON for recipient's name
-            name_ph_for_filename = '{name}'
-            file_prefix = "Relieving_Letter"
-            gen_func = generate_relieving_letter_web
-        
-        timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
-        safe_data_filename = secure_filename(data_file.filename)
-        temp_data_filename = f"upload_bulk_data_{letter_type}_{source_type}_{timestamp}_{safe_data_filename}"
-        data_path = os.path.join(app.config['UPLOAD_FOLDER'], temp_data_filename)
-        data_file.save(data_path)
-        print(f"DEBUG: Saved temporary data file: {data_path}")
-
-        records = []; print(f"DEBUG: Processing {source_type.upper()} data for {letter_type.upper()}...");
-        try:
-            if source_type == 'csv':
-                 df = pd.read_csv(data_path, dtype=str, keep_default_na=False)
-                 # Normalize CSV headers: lowercase and strip spaces for robust matching
-                 df.columns = [col.strip().lower() for col in df.columns]
-                 # Check if the primary name key (normalized) exists in CSV headers
-                 if name_key_in_data.lower().strip() not in df.columns:
-                     raise ValueError(f"Missing required column header: '{name_key_in_data}' in CSV.")
-                 
-                 raw_records = df.to_dict('records')
-                 for row_idx, row_data_dict in enumerate(raw_records):
-                     # Create placeholder dict: {original_case_placeholder_from_csv_header}: value
-                     # We need to map the original CSV headers to placeholders.
-                     # This requires storing original headers before lowercasing, or careful reconstruction.
-                     # For now, assume template placeholders match CSV headers *exactly* (case-insensitively for matching, but template needs exact)
-                     # This implies template placeholders should be like {column name from csv}
-                     
-                     # Corrected approach: CSV headers are directly used as keys for template replacement (wrapped in {})
-                     # Pandas df.to_dict('records') uses the (potentially modified) df.columns as keys.
-                     # We need to use the *original* headers from the CSV if they differ in case/spacing from the template.
-                     # The current df.columns are already normalized (lowercased, stripped).
-                     # To simplify, we'll assume template placeholders are {lowercase_stripped_header_name}.
-                     
-                     # Re-read CSV to get original headers for placeholder creation
-                     original_df = pd.read_csv(data_path, dtype=str, keep_default_na=False, nrows=0) # Read only headers
-                     original_headers = [col.strip() for col in original_df.columns]
-
-                     # Re-read full CSV with normalized headers for data access
-                     df_data = pd.read_csv(data_path, dtype=str, keep_default_na=False)
-                     df_data.columns = [col.strip().lower() for col in df_data.columns] # For access
-                     
-                     current_record_data_list = df_data.to_dict('records')
-                     current_row_data_dict = current_record_data_list[row_idx]
-
-                     # Build template data using original headers as placeholder keys
-                     template_data = {}
-                     for original_header in original_headers:
-                         normalized_header = original_header.lower().strip()
-                         placeholder_key = f"{{{original_header}}}" # Placeholder is {Original CSV Header}
-                         template_data[placeholder_key] = str(current_row_data_dict.get(normalized_header, '')).strip()
-                     records.append(template_data)
-
-
-            elif source_type == 'json':
-                 with open(data_path, 'r', encoding='utf-8') as f: raw_records_list = json.load(f)
-                 if not isinstance(raw_records_list, list): raise ValueError("JSON data must be a list of objects.")
-                 for obj_idx, raw_obj_dict in enumerate(raw_records_list):
-                      if not isinstance(raw_obj_dict, dict): raise ValueError(f"JSON list item at index {obj_idx} must be an object.")
-                      
-                      # Check for name key (case-insensitive for robustness)
-                      found_name_key_original_case = None
-                      for k_obj in raw_obj_dict.keys():
-                          if str(k_obj).strip().lower() == name_key_in_data.lower().strip():
-                              found_name_key_original_case = k_obj; break
-                      if not found_name_key_original_case:
-                          raise ValueError(f"JSON object at index {obj_idx} is missing the required key: '{name_key_in_data}'.")
-
-                      # JSON keys are used directly as placeholder keys (wrapped in {})
-                      template_data = {f"{{{str(k).strip()}}}": str(v).strip() for k, v in raw_obj_dict.items()}
-                      records.append(template_data)
-
-            if not records: flash("No valid records found in data file.", "warning"); raise ValueError("No records")
-
-        except Exception as parse_err: flash(f"Error parsing {source_type.upper()} data: {parse_err}", 'danger'); raise
-
-        # --- Generation Loop ---
-        generated_files_paths = []; gen_errors = []; pdf_fails = 0; success_count = 0; total_records = len(records)
-        if output_format in ['pdf', 'both'] and not DOCX2PDF_AVAILABLE: flash("PDF conversion unavailable.", "warning")
-        
-        for i, record_data_for_template in enumerate(records):
-            # Get recipient name using the placeholder form derived from `name_key_in_data`
-            # For CSV, name_ph_for_filename was set e.g. {candidate name}. The actual placeholder in record_data_for_template
-            # will be {Original CSV Header for candidate name}. We need to find this.
-            # For JSON, name_ph_for_filename was set e.g. {name}. The actual placeholder in record_data_for_template
-            # will be {Original JSON key for name}.
-
-            recipient_name_from_record = ''
-            # Try to find the name value by iterating through keys, comparing lowercased version without braces
-            normalized_name_key_in_data = name_key_in_data.lower().strip()
-            for ph_key, ph_value in record_data_for_template.items():
-                # ph_key is like "{Some Header Name}"
-                key_inside_braces = ph_key.strip()[1:-1] # Remove {}
-                if key_inside_braces.lower().strip() == normalized_name_key_in_data:
-                    recipient_name_from_record = ph_value.strip()
-                    break
-            
-            if not recipient_name_from_record: 
-                gen_errors.append(f"Record {i+1}: Missing or empty value for the name key ('{name_key_in_data}') in the {source_type.upper()} data."); continue;
-
-            suffix_name = recipient_name_from_record.replace(" ","_").replace("/","-").replace("\\","-"); ts_suffix = datetime.datetime.now().strftime('%H%M%S%f')
-            fname_suffix = secure_filename(f"bulk_{letter_type}_{source_type}_{i+1}_{suffix_name}_{ts_suffix}")
-            print(f"--- Processing Bulk {letter_type.upper()} ({source_type.upper()}) ({i+1}/{total_records}): {recipient_name_from_record} ---")
-            success, docx_p, pdf_p, pdf_err = gen_func(actual_template_to_use, record_data_for_template, fname_suffix)
-
-            added = False
-            if success:
-                if output_format in ['docx','both'] and docx_p and os.path.exists(docx_p): generated_files_paths.append(docx_p); added = True
-                if output_format in ['pdf','both']:
-                    if pdf_p and os.path.exists(pdf_p): generated_files_paths.append(pdf_p); added = True
-                    else: pdf_fails += 1;
-                if added: success_count += 1
-                else: gen_errors.append(f"'{recipient_name_from_record}': DOCX generated but no requested output format found/saved.")
-            else: gen_errors.append(f"'{recipient_name_from_record}': Failed ({pdf_err or 'Unknown generation error'})")
-
-        print(f"DEBUG: Bulk {letter_type} ({source_type}) finished. Success: {success_count}/{total_records}");
-        if success_count == 0:
-            flash(f"No {letter_type} documents generated successfully from {source_type} data.", "danger");
-            if gen_errors: flash("Errors: "+"; ".join(gen_errors), "warning");
-            raise ValueError("No successful generation")
-
-        zip_buf = io.BytesIO(); print(f"DEBUG: Creating ZIP ({output_format}) for {letter_type} from {source_type}...")
-        with zipfile.ZipFile(zip_buf, 'w', zipfile.ZIP_DEFLATED) as zf:
-             for fp in generated_files_paths:
-                if os.path.exists(fp): zf.write(fp, os.path.basename(fp))
-                else: print(f"Warning: File listed for zipping but not found: {fp}")
-        zip_buf.seek(0); flash(f"Generated {success_count}/{total_records} {letter_type} documents from {source_type} (Format: {output_format.upper()}).", 'success')
-        if gen_errors: flash("Issues: "+"; ".join(gen_errors), 'warning')
-        if pdf_fails > 0 and output_format != 'docx': flash(f"Note: PDF failed/skipped for {pdf_fails} record(s).", 'info')
-        zip_ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S"); zip_fname = f"Generated_{file_prefix}s_{source_type.upper()}_{output_format.upper()}_{zip_ts}.zip"
-        return send_file(zip_buf, mimetype='application/zip', as_attachment=True, download_name=zip_fname)
-
-    except ValueError: 
-        pass 
-    except Exception as route_err:
-        print(f"CRITICAL Error /generate_bulk ({letter_type}/{source_type}): {route_err}\n{traceback.format_exc()}")
-        flash(f"Unexpected server error during bulk {letter_type} generation from {source_type}.", "danger")
-    finally:
-        safe_cleanup(uploaded_temp_template_path_for_cleanup)
-        safe_cleanup(data_path)
-        if 'generated_files_paths' in locals() and zip_buf: # Only cleanup if zip was created
-             for p_cleanup in generated_files_paths: safe_cleanup(p_cleanup)
-        
-        if 'zip_buf' not in locals() or not zip_buf: 
-             return redirect(url_for('index', active_tab=active_tab_anchor))
-
-
-# --- DOCX to PDF Converter Route ---
-@app.route('/convert_to_pdf', methods=['POST'])
-def handle_convert_to_pdf():
-    active_tab_anchor = 'converter-content'
-    if not DOCX2PDF_AVAILABLE: flash("PDF conversion capability unavailable on server.", "danger"); return redirect(url_for('index', active_tab=active_tab_anchor))
-    if 'docx_file' not in request.files: flash('No DOCX file provided.', 'danger'); return redirect(url_for('index', active_tab=active_tab_anchor))
-    file = request.files['docx_file']; original_filename = file.filename
-    if original_filename == '': flash('No file selected.', 'danger'); return redirect(url_for('index', active_tab=active_tab_anchor))
-    if not allowed_file(original_filename, ALLOWED_EXTENSIONS_DOCX): flash('Invalid file type (.docx required).', 'danger'); return redirect(url_for('index', active_tab=active_tab_anchor))
-    
-    temp_docx_path = None; generated_pdf_path = None
-    try:
-        safe_base = secure_filename(os.path.splitext(original_filename)[0]); ts = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
-        unique_suffix = f"{safe_base}_{ts}"
-        temp_fn = f"upload_convert_in_{unique_suffix}.docx"; temp_docx_path = os.path.join(app.config['UPLOAD_FOLDER'], temp_fn)
-        gen_fn = f"converted_{unique_suffix}.pdf"; generated_pdf_path = os.path.join(app.config['GENERATED_FOLDER'], gen_fn)
-
-        file.save(temp_docx_path); print(f"DEBUG: Converting {original_filename}...")
-        if not docx_to_pdf_convert: raise RuntimeError("PDF Convert function unavailable (internal import issue).")
-        docx_to_pdf_convert(temp_docx_path, generated_pdf_path) 
-        if not os.path.exists(generated_pdf_path): raise RuntimeError("Conversion process completed, but the output PDF file was not found.")
-
-        print(f"✅ Conversion successful: {gen_fn}"); flash(f"Successfully converted '{original_filename}' to PDF.", 'success')
-        return redirect(url_for('index', 
-                                converter_pdf_download=gen_fn, 
-                                original_docx_filename=original_filename, 
-                                active_tab=active_tab_anchor))
-    except Exception as e:
-        error_msg = f"Conversion failed for '{original_filename}': {str(e)}"; print(f"❌ Error in /convert_to_pdf: {e}\n{traceback.format_exc()}"); flash(error_msg, 'danger'); 
-        safe_cleanup(generated_pdf_path); 
-        return redirect(url_for('index', active_tab=active_tab_anchor))
-    finally: 
-        safe_cleanup(temp_docx_path)
-
-
-# --- Download Route ---
-@app.route('/download/<path:filename>')
-def download_file(filename):
-    safe_basename = secure_filename(filename)
-    if not safe_basename or len(safe_basename) < 3:
-        flash("Invalid download filename requested.", "danger")
-        return redirect(url_for('index'))
-
-    generated_dir = app.config['GENERATED_FOLDER']
-    print(f"DEBUG: Download request for '{safe_basename}' from '{generated_dir}'")
-    
-    target_path = os.path.join(generated_dir, safe_basename)
-    # Path traversal check
-    if not os.path.abspath(target_path).startswith(os.path.abspath(generated_dir)):
-        flash("Attempted to access file outside designated area.", "danger")
-        print(f"SECURITY WARNING: Path traversal attempt for filename: {filename}")
-        return redirect(url_for('index'))
-
-    try:
-        return send_from_directory(
-            generated_dir,
-            safe_basename,
-            as_attachment=True
-        )
-    except FileNotFoundError:
-         print(f"Error: Download file not found: {target_path}")
-         flash(f"Sorry, the requested file '{safe_basename}' could not be found on the server.", "warning")
-         return redirect(url_for('index'))
-    except Exception as e:
-         print(f"Error during download processing for '{safe_basename}': {e}")
-         flash("An error occurred while preparing the file for download.", "danger")
-         return redirect(url_for('index'))
-
-
-# === Run the App ===
-if __name__ == "__main__":
-    print("--- Starting BKM Document Tools ---")
-    is_debug_mode = os.environ.get("FLASK_DEBUG", "1") == "1" # Default to debug if not set
-    app.debug = is_debug_mode
-
-    print(f" * Environment: {'development' if app.debug else 'production'}")
-    print(f" * Debug mode: {app.debug}")
-    print(f" * Upload folder: {app.config['UPLOAD_FOLDER']}")
-    print(f" * Generated files folder: {app.config['GENERATED_FOLDER']}")
-    print(f" * User templates folder: {app.config['TEMPLATES_FOLDER']}")
-    print(f" * PDF Conversion Available: {DOCX2PDF_AVAILABLE}")
-    host_addr = os.environ.get("FLASK_RUN_HOST", '0.0.0.0')
-    port_num = int(os.environ.get("FLASK_RUN_PORT", 5000))
-    print(f" * Running on http://{host_addr}:{port_num} (Press CTRL+C to quit)")
-    
-    if app.debug:
-        app.run(host=host_addr, port=port_num)
-    else:
-        # Example for Waitress (production)
-        # from waitress import serve
-        # serve(app, host=host_addr, port=port_num)
-        # For simplicity in this context, still using app.run for non-debug,
-        # but a proper WSGI server is recommended for production.
-        app.run(host=host_addr, port=port_num)
\ No newline at end of file
+import os
+import sys
+import csv
+import json
+import io
+import zipfile
+import datetime
+import time
+import collections
+import copy
+import html
+import importlib
+import functools
+import re
+import traceback # For detailed error logging
+import shutil # For copying files to template library
+import atexit
+import itertools
+import logging
+import subprocess
+import threading
+import tempfile
+import concurrent.futures
+import errno
+import mimetypes
+import socket
+try:
+    import fcntl # POSIX only; used for copy-on-write template clones
+except ImportError:
+    fcntl = None
+from flask import (
+    Flask, render_template, request, send_from_directory,
+    flash, redirect, url_for, Response, Request
+)
+from werkzeug.utils import secure_filename
+from xml.sax.saxutils import escape as xml_escape
+
+# --- Optional ISA-L Accelerated DEFLATE for ZIP I/O ---
+# python-isal's isal_zlib is a faster drop-in for zlib's deflate/CRC32. Only zipfile's view
+# of zlib is swapped, so other users of zlib (and its 0-9 level range) are unaffected.
+# ISA-L only accepts levels 0-3: zlib levels (and -1, the default) are clamped into that range.
+try:
+    import zlib
+    import types
+    from isal import isal_zlib
+
+    def _isal_level(level):
+        if level is None or level < 0:
+            return isal_zlib.Z_DEFAULT_COMPRESSION
+        return min(level, isal_zlib.ISAL_BEST_COMPRESSION)
+
+    _zipfile_zlib = types.SimpleNamespace(**{k: getattr(zlib, k) for k in dir(zlib) if not k.startswith('__')})
+    for _fn in ('decompress', 'decompressobj', 'crc32'):
+        setattr(_zipfile_zlib, _fn, getattr(isal_zlib, _fn))
+    _zipfile_zlib.compressobj = lambda level=-1, *args, **kwargs: isal_zlib.compressobj(_isal_level(level), *args, **kwargs)
+    _zipfile_zlib.compress = lambda data, level=-1, *args, **kwargs: isal_zlib.compress(data, _isal_level(level), *args, **kwargs)
+    _zipfile_zlib.Z_DEFAULT_COMPRESSION = isal_zlib.Z_DEFAULT_COMPRESSION
+    _zipfile_zlib.error = isal_zlib.error
+    zipfile.zlib = _zipfile_zlib
+    zipfile.crc32 = isal_zlib.crc32
+    print("✅ isal found. ZIP compression uses ISA-L.")
+except ImportError:
+    pass
+
+# --- Optional orjson for JSON Parsing ---
+# orjson parses bytes directly in C and is several times faster than the stdlib on large files.
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    json_loads = json.loads
+
+# --- Optional Aho-Corasick Placeholder Matching ---
+# With pyahocorasick installed, each text node is scanned once for all placeholders
+# instead of once per placeholder.
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# --- Lazy Heavy Imports ---
+# lxml (for the DOCX XML parts) and docx2pdf are imported on first use so that
+# worker startup and per-worker memory stay small until a route actually needs them.
+etree = None
+
+def _lxml_etree():
+    """Returns lxml.etree, importing it on first call."""
+    global etree
+    if etree is None:
+        etree = importlib.import_module("lxml.etree")
+    return etree
+
+# --- DOCX2PDF Import and Availability Check ---
+DOCX2PDF_AVAILABLE = None # None = not probed yet; resolved by _get_pdf_converter()
+docx_to_pdf_convert = None
+
+# --- Persistent LibreOffice (unoserver) Pool Check ---
+# When both `soffice` and the `unoserver` client are present, PDFs are rendered by
+# long-lived headless LibreOffice listeners instead of one Office launch per document.
+SOFFICE_PATH = shutil.which("soffice")
+try:
+    from unoserver.client import UnoClient
+    SOFFICE_POOL_AVAILABLE = SOFFICE_PATH is not None
+    if SOFFICE_POOL_AVAILABLE:
+        print(f"✅ soffice found at '{SOFFICE_PATH}' and unoserver available. PDF worker pool enabled.")
+except ImportError:
+    UnoClient = None
+    SOFFICE_POOL_AVAILABLE = False
+
+def _get_pdf_converter():
+    """Probes docx2pdf on first call and caches the result; returns the convert function or None."""
+    global DOCX2PDF_AVAILABLE, docx_to_pdf_convert
+    if DOCX2PDF_AVAILABLE is not None:
+        return docx_to_pdf_convert
+    try:
+        from docx2pdf import convert
+        docx_to_pdf_convert = convert
+        print("✅ docx2pdf library found and imported successfully.")
+    except ImportError:
+        print("⚠️ WARNING: `docx2pdf` library not found. PDF generation will be disabled.")
+        docx_to_pdf_convert = None # Define as None for graceful checks later
+    except Exception as import_err:
+        print(f"⚠️ WARNING: Error importing `docx2pdf`: {import_err}. PDF generation might fail.")
+        docx_to_pdf_convert = None
+    DOCX2PDF_AVAILABLE = docx_to_pdf_convert is not None or SOFFICE_POOL_AVAILABLE or SOFFICE_PATH is not None
+    return docx_to_pdf_convert
+
+def pdf_conversion_available():
+    """True if any PDF backend (soffice pool, soffice CLI or docx2pdf) is usable."""
+    _get_pdf_converter()
+    return DOCX2PDF_AVAILABLE
+
+# === Flask App Setup ===
+logger = logging.getLogger(__name__) # Per-record progress; configured in __main__, silent under WSGI by default
+
+class UploadRequest(Request):
+    """Request that spools large multipart uploads to UPLOAD_FOLDER rather than the system temp dir."""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is None or total_content_length > UPLOAD_SPOOL_MEMORY_BYTES:
+            return tempfile.TemporaryFile('wb+', dir=UPLOAD_FOLDER)
+        return io.BytesIO()
+
+app = Flask(__name__)
+app.request_class = UploadRequest
+app.secret_key = os.environ.get("FLASK_SECRET_KEY", os.urandom(24))
+
+# === Configuration ===
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+UPLOAD_FOLDER = os.path.join(BASE_DIR, 'temp_uploads') # For temporary storage before processing
+GENERATED_FOLDER = os.path.join(BASE_DIR, 'generated_files') # Where final DOCX/PDFs are saved
+TEMPLATES_FOLDER = os.path.join(BASE_DIR, 'user_templates') # For persistent user templates
+ALLOWED_EXTENSIONS_DOCX = ('.docx',) # Suffix tuples for str.endswith
+ALLOWED_EXTENSIONS_DATA = ('.csv', '.json')
+SHM_DIR = '/dev/shm' # tmpfs for bulk scratch files on Linux
+UPLOAD_SPOOL_MEMORY_BYTES = 500 * 1024 # Smaller request bodies stay in memory while parsing
+UPLOAD_COPY_BUFFER = 1024 * 1024 # Chunk size when copying uploads to their destination
+ZIP_COPY_CHUNK = 2 * 1024 * 1024 # Bulk ZIP members are copied and streamed in chunks of this size
+IN_MEMORY_DOCX_MAX_BYTES = 64 * 1024 * 1024 # DOCX-only batches up to this estimate skip scratch files
+ARROW_CSV_MIN_BYTES = 2 * 1024 * 1024 # Larger CSV uploads are parsed with pyarrow when available
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", os.cpu_count() or 1)) # DOCX rendering processes for bulk jobs
+RENDER_POOL_MIN_RECORDS = 8 # Below this, process start-up/pickling costs more than it saves
+SOFFICE_POOL_SIZE = int(os.environ.get("SOFFICE_POOL_SIZE", min(os.cpu_count() or 1, 4)))
+SOFFICE_BASE_PORT = int(os.environ.get("SOFFICE_BASE_PORT", 2002)) # UNO ports; unoserver ports are offset by +100
+SOFFICE_POOL_START_TIMEOUT = float(os.environ.get("SOFFICE_POOL_START_TIMEOUT", 30)) # Seconds to wait for listeners to accept connections
+X_ACCEL_REDIRECT_PREFIX = os.environ.get("X_ACCEL_REDIRECT_PREFIX") # e.g. '/protected/'; nginx internal location aliased to GENERATED_FOLDER
+
+app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['GENERATED_FOLDER'] = GENERATED_FOLDER
+app.config['TEMPLATES_FOLDER'] = TEMPLATES_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024 # 32 MB Upload limit
+app.use_x_sendfile = os.environ.get("USE_X_SENDFILE") == "1" # Let Apache/lighttpd send download bodies via X-Sendfile
+
+# Ensure necessary folders exist with write permissions
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(GENERATED_FOLDER, exist_ok=True)
+os.makedirs(TEMPLATES_FOLDER, exist_ok=True)
+GENERATED_ABS = os.path.realpath(GENERATED_FOLDER) # Resolved once; download_file compares against it
+
+_soffice_pool_lock = threading.Lock()
+_soffice_batch_lock = threading.Lock()
+_render_pool = None
+_render_pool_lock = threading.Lock()
+_template_list_cache = {'mtime': None, 'templates': []} # list_user_templates() memo keyed on folder mtime
+
+# === Helper Functions ===
+
+def allowed_file(filename, allowed_extensions):
+    """Checks if a filename ends with one of the allowed suffixes (case-insensitive)."""
+    return filename.lower().endswith(allowed_extensions)
+
+@functools.lru_cache(maxsize=64)
+def _placeholder_pattern(placeholders):
+    """Compiles (once per placeholder set) one alternation regex, longest placeholders first; None if empty."""
+    alternatives = [re.escape(p) for p in sorted(placeholders, key=lambda p: (-len(p), p)) if p] # Ties sorted: same regex in every process
+    return re.compile('|'.join(alternatives)) if alternatives else None
+
+@functools.lru_cache(maxsize=64)
+def _placeholder_automaton(placeholders):
+    """Builds (once per placeholder set) an Aho-Corasick automaton whose values are the match lengths."""
+    automaton = ahocorasick.Automaton()
+    for placeholder in placeholders:
+        if placeholder:
+            automaton.add_word(placeholder, len(placeholder))
+    automaton.make_automaton()
+    return automaton
+
+def _substitute_with_automaton(text, placeholders_map, automaton):
+    """Replaces all placeholder matches in one pass; overlapping matches keep the earliest."""
+    pieces = []
+    position = 0
+    for end, length in automaton.iter(text): # Matches arrive ordered by end index
+        start = end - length + 1
+        if start < position:
+            continue
+        pieces.append(text[position:start])
+        pieces.append(placeholders_map[text[start:end + 1]])
+        position = end + 1
+    if not pieces:
+        return text
+    pieces.append(text[position:])
+    return "".join(pieces)
+
+@functools.lru_cache(maxsize=64)
+def _braced_keys_only(placeholders):
+    """True if every placeholder is '{...}' with no '}' before its end, so _substitute_braced can match it."""
+    return all(p.startswith('{') and p.find('}') == len(p) - 1 for p in placeholders)
+
+def _substitute_braced(text, values):
+    """
+    Replaces placeholders in one left-to-right pass: each '{' is looked up, up to the next '}',
+    in values. Substituted values are never rescanned, so the result matches the regex and
+    automaton matchers and does not depend on key order. Returns the new text, or None if no
+    placeholder occurred.
+    """
+    pieces = None
+    position = 0
+    start = text.find('{')
+    while start >= 0:
+        end = text.find('}', start + 1)
+        if end < 0:
+            break
+        value = values.get(text[start:end + 1])
+        if value is None:
+            start = text.find('{', start + 1)
+            continue
+        if pieces is None:
+            pieces = []
+        pieces.append(text[position:start])
+        pieces.append(value)
+        position = end + 1
+        start = text.find('{', position)
+    if pieces is None:
+        return None
+    pieces.append(text[position:])
+    return "".join(pieces)
+
+def _text_substituter(data):
+    """
+    Picks the placeholder matcher for one record: a single brace-scan pass when every key is a
+    plain '{...}' placeholder, else Aho-Corasick or the alternation regex. Returns substitute(text) -> new text or None
+    (no placeholder found), or None if data has no placeholders at all.
+    """
+    if not data: # Skip if data is empty
+        return None
+    placeholders_map = data # Keys are '{...}' strings and values pre-normalized strings; no per-record copy
+
+    if _braced_keys_only(frozenset(placeholders_map)):
+        substitute = functools.partial(_substitute_braced, values=placeholders_map)
+    elif ahocorasick:
+        automaton = _placeholder_automaton(frozenset(placeholders_map))
+        def substitute(text):
+            modified_text = _substitute_with_automaton(text, placeholders_map, automaton)
+            return None if modified_text is text else modified_text # Returned unchanged: no placeholder
+    else:
+        pattern = _placeholder_pattern(frozenset(placeholders_map))
+        if pattern is None:
+            return None
+        replace_match = lambda m: placeholders_map[m.group(0)]
+        def substitute(text):
+            modified_text, count = pattern.subn(replace_match, text)
+            return modified_text if count else None
+    return substitute
+
+def replace_text_in_nodes(text_nodes, substitute):
+    """Replaces placeholders in WordprocessingML <w:t> text nodes using a _text_substituter() function."""
+    replacements = 0
+    for node in text_nodes:
+        original_text = node.text
+        if not original_text or '{' not in original_text:
+            continue
+        modified_text = substitute(original_text)
+        if modified_text is None:
+            continue
+        node.text = modified_text
+        if modified_text != modified_text.strip():
+            node.set(XML_SPACE, 'preserve') # Keep leading/trailing spaces from values
+        replacements += 1
+    return replacements
+
+def replace_text_in_xml_bytes(blob, substitute):
+    """
+    Same substitution as replace_text_in_nodes, applied to the serialized part: a bytes regex
+    finds <w:t> runs containing '{' and only those are decoded, substituted and re-escaped.
+    Returns (new_blob, replacements); the original blob is returned when nothing changed.
+    """
+    replacements = 0
+    def replace_run(m):
+        nonlocal replacements
+        raw_text = m.group(2).decode('utf-8')
+        original_text = html.unescape(raw_text) if '&' in raw_text else raw_text
+        modified_text = substitute(original_text)
+        if modified_text is None:
+            return m.group(0)
+        replacements += 1
+        open_tag = m.group(1)
+        if modified_text != modified_text.strip() and b'xml:space' not in open_tag:
+            open_tag = open_tag[:-1] + b' xml:space="preserve">' # Keep leading/trailing spaces from values
+        return open_tag + xml_escape(modified_text).encode('utf-8') + m.group(3)
+    new_blob = W_T_BYTES_RE.sub(replace_run, blob)
+    return (new_blob if replacements else blob), replacements
+
+# Same output as werkzeug's secure_filename for ASCII input, without its regex/normalize pass
+_SAFE_FILENAME_CHARS = set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_.-")
+_SAFE_FILENAME_TBL = {c: None for c in range(128) if chr(c) not in _SAFE_FILENAME_CHARS}
+_NAME_SUFFIX_TBL = str.maketrans({' ': '_', '/': '-', '\\': '-'}) # Recipient name -> filename fragment
+_WINDOWS_DEVICE_FILES = {"CON", "PRN", "AUX", "NUL", *(f"COM{i}" for i in range(10)), *(f"LPT{i}" for i in range(10))}
+
+def fast_secure_filename(filename):
+    """Drop-in for werkzeug's secure_filename using a str.translate table; non-ASCII input defers to werkzeug."""
+    if not filename.isascii():
+        return secure_filename(filename)
+    for sep in (os.sep, os.path.altsep):
+        if sep:
+            filename = filename.replace(sep, " ")
+    filename = "_".join(filename.split()).translate(_SAFE_FILENAME_TBL).strip("._")
+    if os.name == "nt" and filename and filename.split(".")[0].upper() in _WINDOWS_DEVICE_FILES:
+        filename = f"_{filename}"
+    return filename
+
+FICLONE = 0x40049409 # Linux ioctl: reflink-clone a whole file (btrfs/xfs)
+
+def _fast_copy(src, dst):
+    """Copies src to dst via CoW clone (FICLONE), then os.sendfile, then a plain userspace copy."""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(out_fd, FICLONE, in_fd)
+                return
+            except OSError:
+                pass # Filesystem doesn't support reflinks
+        if hasattr(os, 'sendfile'):
+            try:
+                size = os.fstat(in_fd).st_size
+                offset = 0
+                while offset < size:
+                    sent = os.sendfile(out_fd, in_fd, offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                return
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOTSUP, errno.EINVAL, errno.ENOSYS):
+                    raise
+                fdst.seek(0); fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst)
+
+def _link_or_copy(src, dst):
+    """Publishes src at dst as a hardlink (metadata only, atomic replace); copies when linking is not possible."""
+    link_path = f"{dst}.{os.getpid()}.{threading.get_ident()}.link"
+    try:
+        os.link(src, link_path)
+        os.replace(link_path, dst)
+    except OSError: # Different filesystem, or links unsupported
+        safe_cleanup(link_path)
+        _fast_copy(src, dst)
+
+def normalize_value(value):
+    """Normalizes one input value for a placeholder dict: stripped str, with None as ''."""
+    if isinstance(value, str):
+        return value.strip()
+    return '' if value is None else str(value).strip()
+
+def _stream_size(stream):
+    """Returns the total size of a seekable upload stream without moving its position."""
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+def read_csv_rows_arrow(stream, fieldnames):
+    """
+    Parses a large CSV upload with pyarrow's multithreaded reader, all columns as strings.
+    Returns an iterator of row tuples (cells in header order), or None (stream position restored)
+    if pyarrow is missing or the file needs the csv module's leniency (e.g. short rows).
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        return None
+    position = stream.tell()
+    try:
+        stream.seek(0)
+        table = pa_csv.read_csv(
+            stream,
+            read_options=pa_csv.ReadOptions(column_names=list(fieldnames), skip_rows=1, block_size=8 << 20),
+            parse_options=pa_csv.ParseOptions(delimiter=','),
+            convert_options=pa_csv.ConvertOptions(column_types={name: pa.string() for name in fieldnames},
+                                                  strings_can_be_null=False))
+        logger.debug("Parsed %s CSV rows with pyarrow.", table.num_rows)
+        return (row for batch in table.to_batches() for row in zip(*(column.to_pylist() for column in batch.columns)))
+    except Exception as e:
+        print(f"⚠️ WARNING: pyarrow could not parse CSV ({e}); using csv module.")
+        stream.seek(position)
+        return None
+
+def safe_cleanup(filepath):
+    """Attempts to remove a file, logging errors but not crashing."""
+    if not filepath:
+        return
+    try:
+        os.remove(filepath)
+        logger.debug("Cleaned up temporary file: %s", filepath)
+    except FileNotFoundError:
+        pass # Already gone
+    except OSError as e:
+        print(f"Warning: Could not remove temporary file {filepath}: {e}")
+
+def _spawn_soffice_worker(i):
+    """Launches unoserver worker i on its own ports and profile; returns the worker dict or None."""
+    uno_port = SOFFICE_BASE_PORT + i
+    server_port = uno_port + 100
+    profile_dir = os.path.join(BASE_DIR, '.soffice_profiles', f'worker_{i}')
+    os.makedirs(profile_dir, exist_ok=True)
+    cmd = [
+        "unoserver", "--executable", SOFFICE_PATH,
+        "--interface", "127.0.0.1", "--port", str(server_port), "--uno-port", str(uno_port),
+        "--user-installation", f"file://{profile_dir}",
+    ]
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        logger.debug("Started soffice worker %s (pid %s) on port %s", i, proc.pid, server_port)
+        return {'index': i, 'pid': proc.pid, 'port': server_port, 'process': proc}
+    except Exception as e:
+        print(f"⚠️ WARNING: Could not start soffice worker {i}: {e}")
+        return None
+
+def _wait_for_soffice_worker(worker, deadline):
+    """Polls a worker's XML-RPC port until it accepts connections; False if it exits or the deadline passes."""
+    while True:
+        if worker['process'].poll() is not None:
+            return False
+        try:
+            with socket.create_connection(("127.0.0.1", worker['port']), timeout=0.5):
+                return True
+        except OSError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.25)
+
+def _stop_soffice_worker(worker):
+    """Terminates one soffice worker process, killing it if it does not exit in time."""
+    proc = worker['process']
+    if proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+def _disable_soffice_pool(reason):
+    """Stops the pool; from then on conversions use the soffice CLI / Word / docx2pdf paths."""
+    global SOFFICE_POOL_AVAILABLE
+    if SOFFICE_POOL_AVAILABLE:
+        print(f"⚠️ WARNING: soffice worker pool disabled ({reason}); falling back to one-shot PDF conversion.")
+    SOFFICE_POOL_AVAILABLE = False
+    stop_soffice_pool()
+
+def start_soffice_pool():
+    """
+    Starts the persistent headless LibreOffice listeners once per process; returns the pool or None.
+    Only workers whose port accepts connections within SOFFICE_POOL_START_TIMEOUT join the pool;
+    if none do, the pool is disabled.
+    """
+    pool = app.extensions.get("soffice_pool")
+    if pool is not None or not SOFFICE_POOL_AVAILABLE:
+        return pool
+    with _soffice_pool_lock:
+        pool = app.extensions.get("soffice_pool")
+        if pool is not None or not SOFFICE_POOL_AVAILABLE:
+            return pool
+        spawned = [w for w in (_spawn_soffice_worker(i) for i in range(max(SOFFICE_POOL_SIZE, 1))) if w]
+        deadline = time.monotonic() + SOFFICE_POOL_START_TIMEOUT
+        workers = []
+        for worker in spawned:
+            if _wait_for_soffice_worker(worker, deadline):
+                workers.append(worker)
+            else:
+                print(f"⚠️ WARNING: soffice worker {worker['index']} did not start listening on port {worker['port']}.")
+                _stop_soffice_worker(worker)
+        if not workers:
+            _disable_soffice_pool("no worker came up")
+            return None
+        pool = {'workers': workers, 'cycle': itertools.cycle(workers)}
+        app.extensions["soffice_pool"] = pool
+        return pool
+
+def warm_soffice_pool():
+    """Starts the soffice pool in a background thread so the first conversion does not pay Office start-up."""
+    if SOFFICE_POOL_AVAILABLE:
+        threading.Thread(target=start_soffice_pool, name="soffice-pool-warmup", daemon=True).start()
+
+def stop_soffice_pool():
+    """Terminates all soffice pool workers (registered with atexit)."""
+    pool = app.extensions.pop("soffice_pool", None)
+    if not pool:
+        return
+    for worker in pool['workers']:
+        _stop_soffice_worker(worker)
+
+atexit.register(stop_soffice_pool)
+
+def convert_via_uno(docx_bytes):
+    """
+    Converts DOCX bytes to PDF bytes on the next warm soffice worker (round-robin).
+    Raises ConnectionError (after disabling the pool) when no listener can be reached,
+    so callers fall back to the one-shot converters.
+    """
+    pool = start_soffice_pool()
+    if not pool:
+        raise ConnectionError("soffice worker pool unavailable.")
+    with _soffice_pool_lock:
+        worker = next(pool['cycle'])
+        proc = worker['process']
+        if proc.poll() is not None: # Listener died (crash/OOM); replace it in place
+            print(f"⚠️ WARNING: soffice worker {worker['index']} (pid {worker['pid']}) exited with {proc.returncode}; restarting.")
+            replacement = _spawn_soffice_worker(worker['index'])
+            if replacement:
+                worker.update(replacement)
+            if not replacement or not _wait_for_soffice_worker(worker, time.monotonic() + SOFFICE_POOL_START_TIMEOUT):
+                _disable_soffice_pool(f"worker {worker['index']} could not be restarted")
+                raise ConnectionError(f"soffice worker {worker['index']} could not be restarted.")
+    client = UnoClient(server="127.0.0.1", port=str(worker['port']))
+    try:
+        pdf_bytes = client.convert(indata=docx_bytes, convert_to="pdf")
+    except ConnectionError as e:
+        _disable_soffice_pool(f"worker on port {worker['port']} unreachable: {e}")
+        raise
+    if not pdf_bytes:
+        raise RuntimeError(f"soffice worker on port {worker['port']} returned no PDF data.")
+    return pdf_bytes
+
+def _call_docx2pdf(src, dst):
+    """Runs docx2pdf; on Windows, initializes COM for the calling (request/worker) thread first."""
+    pythoncom = None
+    if sys.platform == "win32":
+        try:
+            import pythoncom
+            pythoncom.CoInitialize()
+        except ImportError:
+            pythoncom = None
+    try:
+        docx_to_pdf_convert(src, dst)
+    finally:
+        if pythoncom is not None:
+            pythoncom.CoUninitialize()
+
+WD_EXPORT_FORMAT_PDF = 17 # Word's wdExportFormatPDF
+
+def _word_export_pdfs(pairs):
+    """
+    Windows: converts (docx_path, pdf_path) pairs in one Word instance via COM, paying Word
+    start-up once per batch. Returns False (nothing done) if pywin32 is unavailable.
+    """
+    try:
+        import pythoncom
+        import win32com.client
+    except ImportError:
+        return False
+    pythoncom.CoInitialize()
+    try:
+        word = win32com.client.DispatchEx("Word.Application") # Private instance; never touches the user's Word
+        word.Visible = False
+        word.DisplayAlerts = 0
+        try:
+            for docx_path, pdf_path in pairs:
+                try:
+                    doc = word.Documents.Open(os.path.abspath(docx_path), ReadOnly=True)
+                    try:
+                        doc.ExportAsFixedFormat(os.path.abspath(pdf_path), WD_EXPORT_FORMAT_PDF)
+                    finally:
+                        doc.Close(0) # wdDoNotSaveChanges
+                except Exception as e:
+                    print(f"❌ Error during PDF conversion for '{os.path.basename(docx_path)}': {e}")
+        finally:
+            word.Quit()
+    finally:
+        pythoncom.CoUninitialize()
+    return True
+
+def _convert_on_pool_worker(docx_path, pdf_path):
+    """
+    Converts one file on the soffice pool for batch_docx_to_pdf; failures are logged, not raised.
+    Unreachable listeners are left to batch_docx_to_pdf's one-shot fallback.
+    """
+    try:
+        with open(docx_path, 'rb') as f:
+            pdf_bytes = convert_via_uno(f.read())
+        with open(pdf_path, 'wb') as f:
+            f.write(pdf_bytes)
+    except ConnectionError:
+        safe_cleanup(pdf_path)
+    except Exception as e:
+        print(f"❌ Error during PDF conversion for '{os.path.basename(docx_path)}': {e}")
+        safe_cleanup(pdf_path)
+
+def batch_docx_to_pdf(docx_paths, outdir):
+    """
+    Converts many DOCX files paying Office start-up once: concurrently across the warm soffice
+    pool, else a single headless soffice run, else (without soffice) one Word COM instance on
+    Windows, else one docx2pdf directory conversion, which reuses one Word session.
+    Returns {docx_path: pdf_path or None}; PDFs keep the DOCX base name.
+    """
+    if not docx_paths:
+        return {}
+    pdf_for = lambda docx_path: os.path.join(outdir, os.path.splitext(os.path.basename(docx_path))[0] + '.pdf')
+    pending = docx_paths
+    if SOFFICE_POOL_AVAILABLE:
+        # Threads only wait on the listeners, so one per soffice worker keeps every worker busy
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(SOFFICE_POOL_SIZE, 1)) as executor:
+            for docx_path in docx_paths:
+                executor.submit(_convert_on_pool_worker, docx_path, pdf_for(docx_path))
+        # If the pool turned out to be unreachable, finish the files it missed one-shot below
+        pending = [] if SOFFICE_POOL_AVAILABLE else [p for p in docx_paths if not os.path.exists(pdf_for(p))]
+    if not pending:
+        pass # Everything was converted on the pool
+    elif SOFFICE_PATH:
+        profile_dir = os.path.join(BASE_DIR, '.soffice_profiles', 'batch')
+        cmd = [SOFFICE_PATH, f"-env:UserInstallation=file://{profile_dir}", "--headless", "--nologo",
+               "--nofirststartwizard", "--convert-to", "pdf", "--outdir", outdir, *pending]
+        with _soffice_batch_lock: # One profile directory can only be used by one soffice at a time
+            subprocess.run(cmd, check=True, timeout=600, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    elif sys.platform == "win32" and _word_export_pdfs([(p, pdf_for(p)) for p in pending]):
+        pass # Converted in one Word instance
+    elif _get_pdf_converter():
+        source_dirs = {os.path.dirname(p) for p in pending}
+        source_dir = source_dirs.pop() if len(source_dirs) == 1 else None
+        if source_dir and {f for f in os.listdir(source_dir) if f.lower().endswith('.docx')} == {os.path.basename(p) for p in pending}:
+            _call_docx2pdf(source_dir, outdir) # Directory mode: one Word instance for every file
+        else:
+            for docx_path in pending:
+                _call_docx2pdf(docx_path, pdf_for(docx_path))
+    else:
+        raise RuntimeError("PDF Convert function unavailable (internal import issue).")
+    results = {}
+    for docx_path in docx_paths:
+        pdf_path = pdf_for(docx_path)
+        results[docx_path] = pdf_path if os.path.exists(pdf_path) else None
+    return results
+
+def convert_docx_to_pdf(docx_path, pdf_path, docx_bytes=None):
+    """Converts one DOCX to PDF: soffice worker pool, else soffice CLI, else docx2pdf."""
+    if SOFFICE_POOL_AVAILABLE:
+        if docx_bytes is None:
+            with open(docx_path, 'rb') as f: docx_bytes = f.read()
+        try:
+            pdf_bytes = convert_via_uno(docx_bytes)
+        except ConnectionError: # Pool unreachable and now disabled; use the one-shot converters
+            pdf_bytes = None
+        if pdf_bytes is not None:
+            with open(pdf_path, 'wb') as f:
+                f.write(pdf_bytes)
+            return
+    if SOFFICE_PATH:
+        produced = batch_docx_to_pdf([docx_path], os.path.dirname(pdf_path))[docx_path]
+        if produced and produced != pdf_path:
+            os.replace(produced, pdf_path)
+    elif _get_pdf_converter():
+        _call_docx2pdf(docx_path, pdf_path)
+    else:
+        raise RuntimeError("PDF Convert function unavailable (internal import issue).")
+
+def use_batch_pdf_conversion(output_format):
+    """Bulk routes convert all PDFs in one batch_docx_to_pdf() call whenever a PDF backend exists."""
+    if output_format not in ('pdf', 'both'):
+        return False
+    return pdf_conversion_available()
+
+def apply_batch_pdf_conversion(outcomes, outdir):
+    """
+    Fills in PDF paths for (job, (success, docx_output, None, err)) outcomes produced with
+    convert_pdf=False, using one batch_docx_to_pdf() call for all generated DOCX files.
+    """
+    docx_paths = [docx_output.docx_path for _, (success, docx_output, _, _) in outcomes if success and docx_output and docx_output.docx_path]
+    try:
+        logger.debug("Batch converting %s DOCX file(s) to PDF...", len(docx_paths))
+        pdf_paths = batch_docx_to_pdf(docx_paths, outdir)
+        batch_error = None
+    except Exception as e:
+        print(f"❌ Batch PDF conversion failed: {e}")
+        pdf_paths, batch_error = {}, f"PDF conversion failed: {e}"
+    converted = []
+    for job, (success, docx_output, pdf_path, err) in outcomes:
+        if success and docx_output and docx_output.docx_path:
+            pdf_path = pdf_paths.get(docx_output.docx_path)
+            if not pdf_path:
+                err = batch_error or "PDF Conversion process completed, but the output file was not found."
+        converted.append((job, (success, docx_output, pdf_path, err)))
+    return converted
+
+def list_user_templates():
+    """Lists .docx templates from the TEMPLATES_FOLDER, rescanning only when the folder's mtime changes."""
+    folder = app.config['TEMPLATES_FOLDER']
+    try:
+        mtime = os.stat(folder).st_mtime_ns
+    except OSError:
+        return []
+    if _template_list_cache['mtime'] != mtime:
+        with os.scandir(folder) as it:
+            templates = [e.name for e in it if e.name.lower().endswith('.docx') and e.is_file()]
+        _template_list_cache.update(mtime=mtime, templates=sorted(templates))
+    return list(_template_list_cache['templates'])
+
+def make_work_dir(expected_bytes=0):
+    """
+    Creates a per-request scratch directory for intermediate DOCX/PDF files.
+    Uses /dev/shm (RAM-backed tmpfs) when present with at least 2x expected_bytes free,
+    otherwise the default temp location. The caller removes it with shutil.rmtree.
+    """
+    base_dir = None
+    if os.path.isdir(SHM_DIR):
+        try:
+            if shutil.disk_usage(SHM_DIR).free >= 2 * expected_bytes:
+                base_dir = SHM_DIR
+        except OSError:
+            pass
+    return tempfile.mkdtemp(prefix='offer_', dir=base_dir)
+
+def estimate_batch_bytes(template_path, num_records, output_format):
+    """Rough upper bound for a batch's intermediate files: template size per DOCX and per PDF."""
+    try:
+        template_size = os.path.getsize(template_path)
+    except OSError:
+        return 0
+    return template_size * num_records * (2 if output_format in ('pdf', 'both') else 1)
+
+class PipeBuffer(io.RawIOBase):
+    """Write-only, non-seekable sink for ZipFile; the response generator drains it after each chunk."""
+    def __init__(self):
+        super().__init__()
+        self._chunks = collections.deque()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        """Returns and clears everything written since the last drain."""
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def stream_zip_response(entries, download_name, cleanup_dir=None, batch_time=None):
+    """
+    Streams a ZIP to the client, one member at a time. Entries are file paths inside
+    cleanup_dir (the request's scratch directory) or DocxOutput results, whose docx_bytes
+    (when kept in memory) are written directly. cleanup_dir is removed with one rmtree at the end, files included.
+    batch_time (the route's request timestamp) dates the in-memory entries.
+    """
+    entry_date_time = (batch_time or datetime.datetime.now()).timetuple()[:6]
+    # Largest members first; each file is stat'ed once here and its ZipInfo built from that result
+    sized = []
+    for entry in entries:
+        if isinstance(entry, DocxOutput):
+            if entry.docx_bytes is not None:
+                sized.append((len(entry.docx_bytes), entry, None))
+                continue
+            entry = entry.docx_path
+        st = os.stat(entry)
+        sized.append((st.st_size, entry, st))
+    sized.sort(key=lambda item: item[0], reverse=True)
+    remaining = collections.deque((entry, st) for _, entry, st in sized) # Popped as written, so in-memory outputs are freed progressively
+    del sized
+    def generate():
+        pipe = PipeBuffer()
+        copy_buffer = bytearray(ZIP_COPY_CHUNK) # One read buffer reused for every member of this response
+        copy_view = memoryview(copy_buffer)
+        try:
+            # DOCX/PDF are already compressed internally, so members are stored as-is
+            with zipfile.ZipFile(pipe, 'w', compression=zipfile.ZIP_STORED) as zf:
+                while remaining:
+                    entry, st = remaining.popleft()
+                    if isinstance(entry, DocxOutput):
+                        payload = entry.docx_bytes
+                        zinfo = zipfile.ZipInfo(entry.docx_name, entry_date_time)
+                        zinfo.file_size = len(payload)
+                        zinfo.compress_type = zf.compression
+                        view = memoryview(payload)
+                        with zf.open(zinfo, 'w', force_zip64=zinfo.file_size >= zipfile.ZIP64_LIMIT) as dest:
+                            for offset in range(0, len(view), ZIP_COPY_CHUNK):
+                                dest.write(view[offset:offset + ZIP_COPY_CHUNK])
+                                data = pipe.drain()
+                                if data: yield data
+                        del entry, payload, view
+                    else:
+                        zinfo = zipfile.ZipInfo(os.path.basename(entry), time.localtime(st.st_mtime)[:6])
+                        zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+                        zinfo.file_size = st.st_size
+                        zinfo.compress_type = zf.compression
+                        # Copy in chunks and flush each one to the client: memory stays at one chunk, not one file
+                        with open(entry, 'rb', buffering=0) as src, zf.open(zinfo, 'w', force_zip64=st.st_size >= zipfile.ZIP64_LIMIT) as dest:
+                            while True:
+                                read = src.readinto(copy_buffer)
+                                if not read: break
+                                dest.write(copy_view[:read])
+                                data = pipe.drain()
+                                if data: yield data
+                    data = pipe.drain()
+                    if data: yield data
+            yield pipe.drain()
+        finally:
+            remaining.clear() # Client may have disconnected mid-stream; drop any in-memory outputs
+            if cleanup_dir: shutil.rmtree(cleanup_dir, ignore_errors=True)
+
+    return Response(generate(), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="{download_name}"'})
+
+# === DOCX Template Rendering ===
+# A DOCX is a ZIP of XML parts. Templates are read once into memory and, per document,
+# only the parts that carry placeholders are substituted; everything else is copied.
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+W_T = f'{{{W_NS}}}t'
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+TEXT_PART_RE = re.compile(r'^word/(document|header\d*|footer\d*)\.xml$')
+W_T_BYTES_RE = re.compile(rb'(<w:t(?:\s[^>/]*)?>)([^<]*\{[^<]*)(</w:t>)') # <w:t> runs that contain a '{'
+W_NS_DECL = f'xmlns:w="{W_NS}"'.encode()
+
+def _supports_byte_substitution(blob):
+    """True if a part is UTF-8 and binds the WordprocessingML namespace to the usual w: prefix."""
+    declaration = blob[:blob.find(b'?>')] if blob.startswith(b'<?xml') else b''
+    if b'encoding' in declaration and b'utf-8' not in declaration.lower():
+        return False
+    return W_NS_DECL in blob[:16384] # Namespaces are declared on the root element
+
+@functools.lru_cache(maxsize=32)
+def load_template(path, mtime_ns, size):
+    """
+    Reads every ZIP member of a DOCX template into memory.
+    Cached by (path, mtime_ns, size) so an edited template is picked up automatically.
+    Returns a tuple of (name, date_time, compress_type, external_attr, bytes).
+    """
+    with zipfile.ZipFile(path) as zf:
+        return tuple((info.filename, info.date_time, info.compress_type, info.external_attr, zf.read(info.filename))
+                     for info in zf.infolist())
+
+@functools.lru_cache(maxsize=32)
+def load_template_trees(path, mtime_ns, size):
+    """
+    Classifies the text-bearing parts of a cached template once. Returns {part_name: root_element
+    or None} for parts that may hold placeholders: None means the part is substituted directly on
+    its bytes (replace_text_in_xml_bytes); otherwise renders deep-copy the parsed tree, a C-level
+    copy that is cheaper than re-parsing the XML for every record.
+    """
+    trees = {}
+    for name, _, _, _, blob in load_template(path, mtime_ns, size):
+        if TEXT_PART_RE.match(name) and b'{' in blob: # Parts without a brace cannot hold placeholders
+            trees[name] = None if _supports_byte_substitution(blob) else _lxml_etree().fromstring(blob)
+    return trees
+
+@functools.lru_cache(maxsize=32)
+def load_template_base_zip(path, mtime_ns, size):
+    """
+    Builds, once per template version, a DOCX archive of every member that renders never
+    change (styles, media, settings...), compressed once. Renders append only the
+    placeholder parts to a copy of it instead of re-deflating the whole package per record.
+    """
+    trees = load_template_trees(path, mtime_ns, size)
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w') as zout:
+        for name, date_time, compress_type, external_attr, blob in load_template(path, mtime_ns, size):
+            if name not in trees:
+                _write_template_member(zout, name, date_time, compress_type, external_attr, blob)
+    return out.getvalue()
+
+def _write_template_member(zout, name, date_time, compress_type, external_attr, blob):
+    """Writes one member with the template's metadata (fresh ZipInfo: the cached entries are shared)."""
+    zinfo = zipfile.ZipInfo(name, date_time)
+    zinfo.compress_type = compress_type
+    zinfo.external_attr = external_attr
+    zout.writestr(zinfo, blob)
+
+def clear_template_cache():
+    """Drops all cached templates (called when the template library changes)."""
+    load_template.cache_clear()
+    load_template_trees.cache_clear()
+    load_template_base_zip.cache_clear()
+
+def template_version(template_path):
+    """Returns the (path, mtime_ns, size) key under which a template's parsed forms are cached."""
+    stat = os.stat(template_path)
+    return template_path, stat.st_mtime_ns, stat.st_size
+
+def render_docx_bytes(template_path, data, version=None):
+    """
+    Fills a DOCX template with data; returns (docx_bytes, total_replacements).
+    Bulk callers pass `version` (from template_version) so the template is stat'ed once per batch.
+    """
+    version = version or template_version(template_path)
+    parts = load_template(*version)
+    trees = load_template_trees(*version)
+    base_zip = load_template_base_zip(*version)
+    substitute = _text_substituter(data)
+    total_replacements = 0
+    out = io.BytesIO(base_zip)
+    with zipfile.ZipFile(out, 'a') as zout: # Appends after the unchanged members, rewriting the central directory
+        for name, date_time, compress_type, external_attr, blob in parts:
+            if name not in trees:
+                continue
+            if substitute is not None:
+                if trees[name] is None:
+                    blob, replacements = replace_text_in_xml_bytes(blob, substitute)
+                else:
+                    root = copy.deepcopy(trees[name])
+                    replacements = replace_text_in_nodes(root.iter(W_T), substitute)
+                    if replacements:
+                        blob = _lxml_etree().tostring(root, xml_declaration=True, encoding='UTF-8', standalone=True)
+                total_replacements += replacements
+            _write_template_member(zout, name, date_time, compress_type, external_attr, blob)
+    return out.getvalue(), total_replacements
+
+def _render_row(job):
+    """Process-pool worker: renders one record. Returns (docx_bytes, replacements) or the raised exception."""
+    version, data = job
+    try:
+        return render_docx_bytes(version[0], data, version)
+    except Exception as e:
+        return RuntimeError(f"Rendering failed: {e}")
+
+def _get_render_pool():
+    """Returns the persistent rendering process pool, creating it on first use (None if disabled)."""
+    global _render_pool
+    if RENDER_WORKERS <= 1:
+        return None
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = concurrent.futures.ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+        return _render_pool
+
+def render_docx_many(template_path, records):
+    """
+    Yields one rendered DOCX per record dict, in order. Large batches are spread over the process
+    pool (each worker keeps its own load_template cache); small ones stay in-process. Results are
+    yielded as they arrive, so callers save early records while workers still render later ones.
+    Each result is (docx_bytes, replacements) or an Exception.
+    """
+    pool = _get_render_pool() if len(records) >= RENDER_POOL_MIN_RECORDS else None
+    try:
+        version = template_version(template_path)
+    except OSError: # Every record fails the same way
+        yield from (RuntimeError(f"Template file not found: '{template_path}'") for _ in records)
+        return
+    jobs = [(version, data) for data in records]
+    done = 0
+    if pool is not None:
+        chunksize = max(1, min(32, len(jobs) // (RENDER_WORKERS * 4)))
+        try:
+            for result in pool.map(_render_row, jobs, chunksize=chunksize):
+                yield result
+                done += 1
+        except Exception as e: # e.g. BrokenProcessPool; render the rest here
+            print(f"⚠️ WARNING: Render pool failed ({e}); rendering remaining records in-process.")
+    for job in jobs[done:]:
+        yield _render_row(job)
+
+# === Core Generation Logic Functions ===
+
+# The DOCX result of generate_document_core: docx_path is set when the file was written,
+# docx_bytes instead when it was kept in memory (docx_in_memory); docx_name is always set.
+DocxOutput = collections.namedtuple('DocxOutput', ['docx_path', 'docx_name', 'docx_bytes'])
+
+def generate_document_core(template_path, data, filename_prefix, filename_suffix, rendered=None, convert_pdf=True, output_dir=None, output_format='both', docx_in_memory=False):
+    """
+    Core logic to generate a DOCX and optionally PDF from a template.
+    `rendered` is an optional result from render_docx_many() for this record.
+    `convert_pdf=False` leaves the PDF to a later batch conversion (apply_batch_pdf_conversion).
+    `output_dir` defaults to GENERATED_FOLDER; bulk routes pass their scratch work_dir.
+    `output_format='docx'` skips PDF conversion entirely (the DOCX is always written).
+    Returns (success, DocxOutput or None, pdf_path or None, error_message).
+    `docx_in_memory=True` (DOCX-only bulk) skips the file: the DocxOutput carries docx_bytes
+    instead of docx_path, for stream_zip_response to write straight into the archive.
+    `data` values are pre-normalized strings: every route strips its input once at ingestion.
+    """
+    logger.debug("Generating '%s' for suffix: %s", filename_prefix, filename_suffix)
+    output_dir = output_dir or app.config['GENERATED_FOLDER']
+    docx_filename = f"{filename_prefix}_{filename_suffix}.docx"
+    docx_save_path = os.path.join(output_dir, docx_filename)
+    pdf_filename = f"{filename_prefix}_{filename_suffix}.pdf"
+    pdf_save_path = os.path.join(output_dir, pdf_filename)
+    pdf_final_path = None
+    error_message = None
+
+    try:
+        if rendered is None and not os.path.exists(template_path): # Pre-rendered records already read it
+            return False, None, None, f"Template file not found: '{template_path}'"
+        if not data or not isinstance(data, dict):
+            return False, None, None, "Invalid or missing data for document generation."
+
+        if rendered is None:
+            logger.debug("Rendering template %s for %s...", template_path, filename_prefix)
+            rendered = render_docx_bytes(template_path, data)
+        elif isinstance(rendered, Exception):
+            raise rendered # Rendering failed in a pool worker
+        docx_bytes, total_replacements = rendered
+
+        if total_replacements == 0:
+            print(f"⚠️ Warning: No placeholders were replaced for '{filename_suffix}' ({filename_prefix}). Check template & data keys.")
+
+        if docx_in_memory and output_format == 'docx':
+            logger.info("✅ Generated DOCX: %s (in memory)", docx_filename)
+            return True, DocxOutput(None, docx_filename, docx_bytes), None, None
+
+        logger.debug("Saving DOCX to: %s", docx_save_path)
+        with open(docx_save_path, 'wb') as f: # Raises on failure; no need to stat afterwards
+            f.write(docx_bytes)
+        logger.info("✅ Generated DOCX: %s", docx_filename)
+
+        pdf_specific_error = None
+        if output_format == 'docx':
+            logger.debug("PDF conversion for %s not requested (DOCX only).", filename_suffix)
+        elif not convert_pdf:
+            logger.debug("PDF conversion for %s deferred to batch conversion.", filename_suffix)
+        elif pdf_conversion_available():
+            logger.debug("Attempting PDF conversion: %s -> %s", docx_filename, pdf_filename)
+            try:
+                convert_docx_to_pdf(docx_save_path, pdf_save_path, docx_bytes=docx_bytes)
+                if os.path.exists(pdf_save_path):
+                    pdf_final_path = pdf_save_path
+                    logger.info("✅ Generated PDF: %s", pdf_filename)
+                else:
+                    pdf_specific_error = "PDF Conversion process completed, but the output file was not found."
+                    print(f"❌ {pdf_specific_error}")
+            except Exception as pdf_err:
+                 pdf_specific_error = f"PDF conversion failed: {str(pdf_err)}"
+                 print(f"❌ Error during PDF conversion for '{filename_suffix}': {pdf_err}")
+                 flash(f"Warning: PDF generation failed for {filename_suffix}. DOCX created. Error: {str(pdf_err)}", "warning")
+        else:
+            logger.debug("PDF conversion skipped for %s (library/function not available).", filename_suffix)
+
+        return True, DocxOutput(docx_save_path, docx_filename, None), pdf_final_path, pdf_specific_error
+
+    except Exception as e:
+        error_message = f"Failed to generate {filename_prefix} for '{filename_suffix}': {str(e)}"
+        print(f"❌ {error_message}")
+        print(traceback.format_exc())
+        safe_cleanup(docx_save_path) # Cleanup partially generated docx
+        safe_cleanup(pdf_save_path) # Cleanup partially generated pdf
+        return False, None, None, error_message
+
+# Wrapper functions
+def generate_offer_letter_web(template_path, data, filename_suffix, rendered=None, convert_pdf=True, output_dir=None, output_format='both', docx_in_memory=False):
+     return generate_document_core(template_path, data, "Offer_Letter", filename_suffix, rendered=rendered, convert_pdf=convert_pdf, output_dir=output_dir, output_format=output_format, docx_in_memory=docx_in_memory)
+
+def generate_relieving_letter_web(template_path, data, filename_suffix, rendered=None, convert_pdf=True, output_dir=None, output_format='both', docx_in_memory=False):
+     return generate_document_core(template_path, data, "Relieving_Letter", filename_suffix, rendered=rendered, convert_pdf=convert_pdf, output_dir=output_dir, output_format=output_format, docx_in_memory=docx_in_memory)
+
+# === Flask Routes ===
+
+@app.context_processor
+def inject_global_vars():
+    return {
+        'current_year': datetime.datetime.now().year,
+        'user_templates': list_user_templates() # Make templates available to all renders
+    }
+
+@app.route('/')
+def index():
+    # Check if 'active_tab' is passed from a redirect and preserve it
+    active_tab = request.args.get('active_tab', None)
+    # Check if specific download info is passed and preserve it
+    letter_type = request.args.get('letter_type', None)
+    docx_download = request.args.get('docx_download', None)
+    pdf_download = request.args.get('pdf_download', None)
+    recipient_name = request.args.get('recipient_name', None)
+    converter_pdf_download = request.args.get('converter_pdf_download', None)
+    original_docx_filename = request.args.get('original_docx_filename', None)
+
+    return render_template('index.html',
+                           active_tab=active_tab,
+                           letter_type=letter_type,
+                           docx_download=docx_download,
+                           pdf_download=pdf_download,
+                           recipient_name=recipient_name,
+                           converter_pdf_download=converter_pdf_download,
+                           original_docx_filename=original_docx_filename)
+
+
+# --- Template Management Routes ---
+@app.route('/upload_user_template', methods=['POST'])
+def handle_upload_user_template():
+    active_tab_anchor = 'manage-templates-content'
+    if 'user_template_file' not in request.files:
+        flash('No template file provided for library upload.', 'danger')
+        return redirect(url_for('index', active_tab=active_tab_anchor))
+    
+    file = request.files['user_template_file']
+    if file.filename == '':
+        flash('No file selected for library upload.', 'danger')
+        return redirect(url_for('index', active_tab=active_tab_anchor))
+
+    if file and allowed_file(file.filename, ALLOWED_EXTENSIONS_DOCX):
+        filename = fast_secure_filename(file.filename)
+        save_path = os.path.join(app.config['TEMPLATES_FOLDER'], filename)
+        
+        if os.path.exists(save_path) and not request.form.get('overwrite_template'):
+            flash(f"Template '{filename}' already exists. Check 'Overwrite' to replace it.", 'warning')
+            return redirect(url_for('index', active_tab=active_tab_anchor))
+            
+        try:
+            file.save(save_path, buffer_size=UPLOAD_COPY_BUFFER)
+            clear_template_cache()
+            flash(f"Template '{filename}' uploaded successfully to library.", 'success')
+        except Exception as e:
+            flash(f"Error uploading template '{filename}': {e}", 'danger')
+    else:
+        flash('Invalid file type. Only .docx templates are allowed.', 'danger')
+    return redirect(url_for('index', active_tab=active_tab_anchor))
+
+
+@app.route('/delete_user_template/<path:filename>', methods=['POST'])
+def handle_delete_user_template(filename):
+    active_tab_anchor = 'manage-templates-content'
+    safe_filename = fast_secure_filename(filename)
+    if not safe_filename:
+        flash("Invalid template filename for deletion.", "danger")
+        return redirect(url_for('index', active_tab=active_tab_anchor))
+
+    template_path = os.path.join(app.config['TEMPLATES_FOLDER'], safe_filename)
+    if os.path.exists(template_path):
+        try:
+            os.remove(template_path)
+            clear_template_cache()
+            flash(f"Template '{safe_filename}' deleted successfully.", 'success')
+        except Exception as e:
+            flash(f"Error deleting template '{safe_filename}': {e}", 'danger')
+    else:
+        flash(f"Template '{safe_filename}' not found for deletion.", 'warning')
+    return redirect(url_for('index', active_tab=active_tab_anchor))
+
+
+# --- Helper for processing template choice ---
+def process_template_input(letter_type_for_log="document"):
+    """
+    Processes template input from form (existing library template or new upload).
+    Returns (actual_template_path_to_use, temp_uploaded_path_for_cleanup_if_any)
+    Returns (None, None) on error and flashes messages.
+    """
+    template_choice = request.form.get('template_choice')
+    selected_template_filename = request.form.get('selected_template_filename')
+    save_to_library = request.form.get('save_uploaded_template_to_library') == 'on'
+    
+    actual_template_path = None
+    temp_uploaded_path = None
+
+    if template_choice == 'existing_template':
+        if not selected_template_filename:
+            flash('Please select an existing template from the library.', 'danger')
+            return None, None
+        
+        safe_selected_filename = fast_secure_filename(os.path.basename(selected_template_filename))
+        if not safe_selected_filename: 
+            flash('Invalid selected template name.', 'danger')
+            return None, None
+
+        actual_template_path = os.path.join(app.config['TEMPLATES_FOLDER'], safe_selected_filename)
+        if not os.path.exists(actual_template_path):
+            flash(f'Selected library template "{safe_selected_filename}" not found.', 'danger')
+            return None, None
+        logger.debug("Using existing template: %s", actual_template_path)
+
+    elif template_choice == 'upload_new_template':
+        if 'template_file' not in request.files or not request.files['template_file'].filename:
+            flash(f'No template file provided for new upload ({letter_type_for_log}).', 'danger')
+            return None, None
+        
+        template_file = request.files['template_file']
+        if not allowed_file(template_file.filename, ALLOWED_EXTENSIONS_DOCX):
+            flash(f'Invalid template file type for {letter_type_for_log} (.docx required).', 'danger')
+            return None, None
+
+        original_filename = fast_secure_filename(template_file.filename)
+        timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
+        
+        temp_filename_for_processing = f"runtime_upload_{letter_type_for_log}_{timestamp}_{original_filename}"
+        temp_uploaded_path = os.path.join(app.config['UPLOAD_FOLDER'], temp_filename_for_processing)
+        
+        try:
+            template_file.save(temp_uploaded_path, buffer_size=UPLOAD_COPY_BUFFER)
+            actual_template_path = temp_uploaded_path 
+            logger.debug("Saved temporary uploaded template: %s", temp_uploaded_path)
+        except Exception as e:
+            flash(f"Error saving temporary template: {e}", "danger")
+            safe_cleanup(temp_uploaded_path)
+            return None, None
+
+        if save_to_library:
+            library_path = os.path.join(app.config['TEMPLATES_FOLDER'], original_filename)
+            try:
+                if os.path.exists(library_path) and not request.form.get('overwrite_if_exists_in_library_from_form'): 
+                     flash(f"Template '{original_filename}' already exists in library. Not overwritten from this form. Use 'Manage Templates' to explicitly overwrite.", 'warning')
+                else:
+                    _link_or_copy(temp_uploaded_path, library_path)
+                    clear_template_cache()
+                    flash(f"Template '{original_filename}' saved to library.", "info")
+                    app.jinja_env.globals.update(user_templates=list_user_templates())
+            except Exception as e:
+                flash(f"Could not save uploaded template '{original_filename}' to library: {e}", "warning")
+    else:
+        flash('Invalid template choice. Please select or upload a template.', 'danger')
+        return None, None
+        
+    return actual_template_path, temp_uploaded_path
+
+
+# --- Single Generation Routes ---
+@app.route('/generate_single_offer', methods=['POST'])
+def handle_generate_single_offer():
+    letter_type = 'offer'
+    uploaded_temp_template_path_for_cleanup = None
+    recipient_name_field = 'candidate name' # This is the HTML form field name
+    
+    # *** CORRECTED KEYS TO MATCH HTML UNDERSCORE CONVENTION WHERE APPLICABLE ***
+    form_to_placeholder = {
+        "send_date": "{send date}", "candidate name": "{candidate name}", "designation": "{designation}",
+        "fdesignation": "{fdesignation}", "email": "{email}", 
+        "mobile_number": "{mobile number}",  # Expects HTML name="mobile_number"
+        "dear_name": "{dear name}",          # Expects HTML name="dear_name"
+        "joining_date": "{joining date}", "hr_name": "{hr name}", "lpa": "{lpa}"
+    }
+    # The field used for filename suffix and display messages
+    # This assumes 'candidate name' (with space) is correctly mapped if `recipient_name_field` is 'candidate name'
+    recipient_name_from_form = request.form.get(recipient_name_field, f'Unknown_{letter_type}_Recipient').strip()
+    success_flag = False 
+    active_tab_anchor = f'{letter_type}-single-content'
+    
+    try:
+        actual_template_to_use, uploaded_temp_template_path_for_cleanup = process_template_input(letter_type)
+        if not actual_template_to_use:
+            return redirect(url_for('index', active_tab=active_tab_anchor))
+
+        form_data = {}
+        missing_fields = []
+        for field_key, placeholder in form_to_placeholder.items():
+            # `field_key` is what we use with request.form.get()
+            value = request.form.get(field_key, '').strip() 
+            is_required = field_key != "fdesignation" 
+            if not value and is_required:
+                missing_fields.append(f"'{field_key.replace('_', ' ')}'") # Make field name more readable for flash
+            form_data[placeholder] = value
+
+        if missing_fields:
+             flash(f"Missing required {letter_type} details: {', '.join(missing_fields)}.", 'danger')
+             raise ValueError("Missing fields")
+
+        name_suffix = recipient_name_from_form.translate(_NAME_SUFFIX_TBL)
+        output_timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        filename_suffix = fast_secure_filename(f"single_{letter_type}_{name_suffix}_{output_timestamp}")
+
+        print(f"--- Generating Single {letter_type.capitalize()}: {recipient_name_from_form} ---")
+        gen_success, docx_output, pdf_path, error_msg = generate_offer_letter_web(
+             actual_template_to_use, form_data, filename_suffix
+        )
+
+        if gen_success:
+            success_flag = True
+            flash(f"Successfully generated {letter_type} document(s) for {recipient_name_from_form}.", 'success')
+            final_docx = docx_output.docx_name if docx_output else None
+            final_pdf = os.path.basename(pdf_path) if pdf_path else None
+            if not final_docx:
+                 flash("Internal Error: Generated DOCX file not found.", "danger")
+                 return redirect(url_for('index', active_tab=active_tab_anchor))
+            # Pass results back to index page via query parameters for display
+            return redirect(url_for('index', 
+                                   letter_type=letter_type,
+                                   docx_download=final_docx,
+                                   pdf_download=final_pdf,
+                                   recipient_name=recipient_name_from_form,
+                                   active_tab=active_tab_anchor))
+        else:
+            flash(f"Error generating {letter_type} letter for {recipient_name_from_form}: {error_msg}", 'danger')
+            return redirect(url_for('index', active_tab=active_tab_anchor))
+
+    except ValueError: 
+        pass 
+    except Exception as route_err:
+        print(f"CRITICAL Route Error in /generate_single_{letter_type}: {route_err}\n{traceback.format_exc()}")
+        flash(f"Unexpected server error during single {letter_type} generation.", "danger")
+    finally:
+        safe_cleanup(uploaded_temp_template_path_for_cleanup)
+        if not success_flag: 
+             return redirect(url_for('index', active_tab=active_tab_anchor))
+
+
+@app.route('/generate_single_relieving', methods=['POST'])
+def handle_generate_single_relieving():
+    letter_type = 'relieving'
+    uploaded_temp_template_path_for_cleanup = None
+    recipient_name_field = 'name' # HTML form field name
+    form_to_placeholder = { # Keys are HTML form field names
+        "send_date": "{send date}", "name": "{name}", "role": "{role}",
+        "working_date": "{working date}", "accepted_date": "{accepted date}",
+        "relieved_date": "{relieved date}", "hr_name": "{hr name}"
+    }
+    recipient_name_from_form = request.form.get(recipient_name_field, f'Unknown_{letter_type}_Recipient').strip()
+    success_flag = False
+    active_tab_anchor = f'{letter_type}-single-content'
+    try:
+        actual_template_to_use, uploaded_temp_template_path_for_cleanup = process_template_input(letter_type)
+        if not actual_template_to_use:
+            return redirect(url_for('index', active_tab=active_tab_anchor))
+
+        form_data = {}
+        missing_fields = []
+        for field_key, placeholder in form_to_placeholder.items():
+             value = request.form.get(field_key, '').strip()
+             if not value: 
+                  missing_fields.append(f"'{field_key.replace('_', ' ')}'")
+             form_data[placeholder] = value
+        if missing_fields:
+             flash(f"Missing required {letter_type} details: {', '.join(missing_fields)}.", 'danger'); raise ValueError("Missing fields")
+
+        name_suffix = recipient_name_from_form.translate(_NAME_SUFFIX_TBL)
+        output_timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        filename_suffix = fast_secure_filename(f"single_{letter_type}_{name_suffix}_{output_timestamp}")
+
+        print(f"--- Generating Single {letter_type.capitalize()}: {recipient_name_from_form} ---")
+        gen_success, docx_output, pdf_path, error_msg = generate_relieving_letter_web(
+             actual_template_to_use, form_data, filename_suffix
+        )
+
+        if gen_success:
+            success_flag = True
+            flash(f"Successfully generated {letter_type} document(s) for {recipient_name_from_form}.", 'success')
+            final_docx = docx_output.docx_name if docx_output else None
+            final_pdf = os.path.basename(pdf_path) if pdf_path else None
+            if not final_docx: flash("Internal Error: Generated DOCX file not found.", "danger"); return redirect(url_for('index', active_tab=active_tab_anchor))
+            return redirect(url_for('index', 
+                                   letter_type=letter_type, 
+                                   docx_download=final_docx, 
+                                   pdf_download=final_pdf, 
+                                   recipient_name=recipient_name_from_form, 
+                                   active_tab=active_tab_anchor))
+        else: 
+            flash(f"Error generating {letter_type} letter for {recipient_name_from_form}: {error_msg}", 'danger')
+            return redirect(url_for('index', active_tab=active_tab_anchor))
+
+    except ValueError:
+        pass
+    except Exception as route_err:
+         print(f"CRITICAL Route Error in /generate_single_{letter_type}: {route_err}\n{traceback.format_exc()}"); flash(f"Unexpected server error during single {letter_type} generation.", "danger")
+    finally:
+        safe_cleanup(uploaded_temp_template_path_for_cleanup)
+        if not success_flag:
+             return redirect(url_for('index', active_tab=active_tab_anchor))
+
+
+# --- Bulk Generation Routes ---
+
+@app.route('/generate_bulk_manual_offer', methods=['POST'])
+def handle_generate_bulk_manual_offer():
+    letter_type = 'offer'
+    uploaded_temp_template_path_for_cleanup = None
+    zip_response = None
+    work_dir = None
+    output_format = request.form.get('output_format', 'both')
+    # Keys are HTML form field names (generated by JS with underscores)
+    form_to_placeholder = {
+        "candidate_name": "{candidate name}", "send_date": "{send date}", "designation": "{designation}",
+        "fdesignation": "{fdesignation}", "email": "{email}", "mobile_number": "{mobile number}",
+        "dear_name": "{dear name}", "joining_date": "{joining date}", "hr_name": "{hr name}", "lpa": "{lpa}"
+    }
+    required_fields = ['candidate_name', 'send_date', 'designation', 'email', 'mobile_number', 'dear_name', 'joining_date', 'hr_name', 'lpa'] # These are the form field name keys
+    name_field_key = 'candidate_name' # This is a form field name key
+    active_tab_anchor = 'offer-manual-content'
+
+    try:
+        actual_template_to_use, uploaded_temp_template_path_for_cleanup = process_template_input(f"manual_bulk_{letter_type}")
+        if not actual_template_to_use:
+            return redirect(url_for('index', active_tab=active_tab_anchor))
+
+        submitted_lists = dict(request.form.lists()) # One pass over the MultiDict
+        field_keys = tuple(form_to_placeholder)
+        placeholders = tuple(form_to_placeholder.values())
+        columns = [submitted_lists.get(field_key, []) for field_key in field_keys]
+        num_entries = len(submitted_lists.get(name_field_key, []))
+
+        if num_entries == 0: flash("No entry details submitted for manual bulk offer.", "warning"); raise ValueError("No entries")
+
+        if len({len(column) for column in columns}) != 1:
+            field_name_check, column = next((k, c) for k, c in zip(field_keys, columns) if len(c) != num_entries)
+            flash(f"Data mismatch: Inconsistent number of entries for field '{field_name_check.replace('_', ' ')}'. Expected {num_entries}, got {len(column)}.", "danger")
+            raise ValueError("List length mismatch")
+        logger.debug("Processing %s manually entered %s letters.", num_entries, letter_type)
+
+        generated_files_paths = []; generation_errors = []; pdf_failures = 0; successful_records_count = 0; jobs = []
+        deferred_warnings = [] # Per-entry warnings, printed in one write after the loops
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
+        if output_format in ['pdf', 'both'] and not pdf_conversion_available(): flash("PDF conversion unavailable.", "warning")
+
+        batch_now = datetime.datetime.now() # One clock read per request: entry names and the ZIP name share it
+        out_ts = batch_now.strftime('%H%M%S%f') # The entry index keeps names unique; work_dir is private to this request
+        name_index = field_keys.index(name_field_key)
+        required_columns = [(pos, f"'{field_key.replace('_', ' ')}'") for pos, field_key in enumerate(field_keys) if field_key in required_fields]
+        for i, raw_values in enumerate(zip(*columns)):
+            values = [value.strip() for value in raw_values] # Each cell is stripped exactly once
+            current_data_for_template = dict(zip(placeholders, values))
+            recipient_name = values[name_index]
+            current_missing_fields_keys = [label for pos, label in required_columns if not values[pos]]
+
+            if not recipient_name:
+                 err_msg = f"Manual {letter_type.capitalize()} Entry {i+1}: Skipping (Missing '{name_field_key.replace('_', ' ')}')"; deferred_warnings.append(err_msg); generation_errors.append(err_msg); continue
+            if current_missing_fields_keys:
+                 err_msg = f"Manual {letter_type.capitalize()} Entry {i+1} ('{recipient_name}'): Missing fields: {', '.join(current_missing_fields_keys)}"; deferred_warnings.append(err_msg); generation_errors.append(err_msg); continue
+
+            name_suffix = recipient_name.translate(_NAME_SUFFIX_TBL)
+            filename_suffix = fast_secure_filename(f"manual_{letter_type}_{i+1}_{name_suffix}_{out_ts}")
+            jobs.append((i, recipient_name, current_data_for_template, filename_suffix))
+
+        expected_bytes = estimate_batch_bytes(actual_template_to_use, len(jobs), output_format)
+        work_dir = make_work_dir(expected_bytes)
+        docx_in_memory = output_format == 'docx' and expected_bytes <= IN_MEMORY_DOCX_MAX_BYTES
+        rendered_docs = render_docx_many(actual_template_to_use, [job[2] for job in jobs])
+        batch_pdf = use_batch_pdf_conversion(output_format)
+        outcomes = []
+        for (i, recipient_name, current_data_for_template, filename_suffix), rendered in zip(jobs, rendered_docs):
+            if debug_enabled: logger.debug("--- Processing Manual %s (%s/%s): %s ---", letter_type.capitalize(), i+1, num_entries, recipient_name)
+            outcomes.append(((i, recipient_name, current_data_for_template, filename_suffix), generate_offer_letter_web(actual_template_to_use, current_data_for_template, filename_suffix, rendered=rendered, convert_pdf=not batch_pdf, output_dir=work_dir, output_format=output_format, docx_in_memory=docx_in_memory)))
+        if batch_pdf: outcomes = apply_batch_pdf_conversion(outcomes, work_dir)
+
+        for (i, recipient_name, current_data_for_template, filename_suffix), (gen_success, docx_output, pdf_path, pdf_err_msg) in outcomes:
+
+            added_files_for_record = False
+            if gen_success:
+                 if output_format in ['docx', 'both'] and docx_output: generated_files_paths.append(docx_output); added_files_for_record = True
+                 if output_format in ['pdf', 'both']:
+                     if pdf_path:
+                         generated_files_paths.append(pdf_path); added_files_for_record = True
+                     else:
+                         pdf_failures += 1 
+                         if pdf_err_msg and debug_enabled: logger.debug("PDF failure reason for '%s': %s", recipient_name, pdf_err_msg)
+                 if added_files_for_record:
+                     successful_records_count += 1
+                 else:
+                     err = f"'{recipient_name}' (Manual {letter_type.capitalize()}): DOCX generated but no requested output format found/saved."
+                     generation_errors.append(err); deferred_warnings.append(err)
+            else:
+                fail_reason = pdf_err_msg or 'Generation core function returned False.'
+                generation_errors.append(f"'{recipient_name}' (Manual {letter_type.capitalize()}): Generation failed ({fail_reason})")
+
+        if deferred_warnings: print("\n".join(f"Warning: {msg}" for msg in deferred_warnings))
+        logger.debug("Manual bulk %s finished. Success: %s/%s", letter_type, successful_records_count, num_entries)
+        if successful_records_count == 0:
+             flash(f"No {letter_type} letters generated successfully from manual entries.", "danger");
+             if generation_errors: flash("Errors: " + "; ".join(generation_errors), "warning");
+             raise ValueError("No successful generation")
+
+        logger.debug("Streaming Manual %s ZIP (%s)...", letter_type.capitalize(), output_format)
+        success_msg = f"Generated documents for {successful_records_count}/{num_entries} manual {letter_type} entries (Format: {output_format.upper()})."; flash(success_msg, 'success')
+        if generation_errors: flash("Issues: " + "; ".join(generation_errors), 'warning')
+        if pdf_failures > 0 and output_format != 'docx': flash(f"Note: PDF failed/skipped for {pdf_failures} entries.", 'info')
+        zip_filename_ts = batch_now.strftime("%Y%m%d_%H%M%S"); zip_filename = f"Generated_Manual_Offers_{output_format.upper()}_{zip_filename_ts}.zip"
+        # Do not redirect here, the streamed ZIP will be the response
+        zip_response = stream_zip_response(generated_files_paths, zip_filename, cleanup_dir=work_dir, batch_time=batch_now)
+        return zip_response
+
+    except ValueError: 
+        pass 
+    except Exception as route_err:
+        print(f"CRITICAL Error /generate_bulk_manual_{letter_type}: {route_err}\n{traceback.format_exc()}"); flash("Unexpected server error during manual bulk generation.", "danger")
+    finally:
+        safe_cleanup(uploaded_temp_template_path_for_cleanup)
+        # work_dir (and every generated file in it) is removed by the ZIP stream once sent
+        if not zip_response: # Redirect if zip wasn't created/sent
+             if work_dir: shutil.rmtree(work_dir, ignore_errors=True)
+             return redirect(url_for('index', active_tab=active_tab_anchor))
+
+
+@app.route('/generate_bulk_manual_relieving', methods=['POST'])
+def handle_generate_bulk_manual_relieving():
+    letter_type = 'relieving'
+    uploaded_temp_template_path_for_cleanup = None
+    zip_response = None
+    work_dir = None
+    output_format = request.form.get('output_format', 'both')
+    # Keys are HTML form field names (generated by JS with underscores if applicable)
+    form_to_placeholder = {
+        "name": "{name}", "send_date": "{send date}", "role": "{role}",
+        "working_date": "{working date}", "accepted_date": "{accepted date}",
+        "relieved_date": "{relieved date}", "hr_name": "{hr name}"
+    }
+    required_fields_keys = list(form_to_placeholder.keys()) # All are required for relieving
+    name_field_key = 'name' # This is a form field name key
+    active_tab_anchor = 'relieving-manual-content'
+
+    try:
+        actual_template_to_use, uploaded_temp_template_path_for_cleanup = process_template_input(f"manual_bulk_{letter_type}")
+        if not actual_template_to_use:
+            return redirect(url_for('index', active_tab=active_tab_anchor))
+
+        submitted_lists = dict(request.form.lists()) # One pass over the MultiDict
+        field_keys = tuple(form_to_placeholder)
+        placeholders = tuple(form_to_placeholder.values())
+        columns = [submitted_lists.get(field_key, []) for field_key in field_keys]
+        num_entries = len(submitted_lists.get(name_field_key, []))
+
+        if num_entries == 0: flash("No entry details submitted for manual bulk relieving.", "warning"); raise ValueError("No entries")
+
+        if len({len(column) for column in columns}) != 1:
+            field_name_check, column = next((k, c) for k, c in zip(field_keys, columns) if len(c) != num_entries)
+            flash(f"Data mismatch: Inconsistent number of entries for field '{field_name_check.replace('_', ' ')}'. Expected {num_entries}, got {len(column)}.", "danger")
+            raise ValueError("List length mismatch")
+
+        logger.debug("Processing %s manually entered %s letters.", num_entries, letter_type)
+
+        generated_files_paths = []; generation_errors = []; pdf_failures = 0; successful_records_count = 0; jobs = []
+        deferred_warnings = [] # Per-entry warnings, printed in one write after the loops
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
+        if output_format in ['pdf', 'both'] and not pdf_conversion_available(): flash("PDF conversion unavailable.", "warning")
+
+        batch_now = datetime.datetime.now() # One clock read per request: entry names and the ZIP name share it
+        out_ts = batch_now.strftime('%H%M%S%f') # The entry index keeps names unique; work_dir is private to this request
+        name_index = field_keys.index(name_field_key)
+        required_columns = [(pos, f"'{field_key.replace('_', ' ')}'") for pos, field_key in enumerate(field_keys) if field_key in required_fields_keys]
+        for i, raw_values in enumerate(zip(*columns)):
+            values = [value.strip() for value in raw_values] # Each cell is stripped exactly once
+            current_data_for_template = dict(zip(placeholders, values))
+            recipient_name = values[name_index]
+            current_missing_fields_keys = [label for pos, label in required_columns if not values[pos]]
+
+            if not recipient_name: 
+                 err_msg = f"Manual {letter_type.capitalize()} Entry {i+1}: Skipping (Missing '{name_field_key.replace('_', ' ')}')"; deferred_warnings.append(err_msg); generation_errors.append(err_msg); continue
+            if current_missing_fields_keys:
+                 err_msg = f"Manual {letter_type.capitalize()} Entry {i+1} ('{recipient_name}'): Missing fields: {', '.join(current_missing_fields_keys)}"; deferred_warnings.append(err_msg); generation_errors.append(err_msg); continue
+
+            name_suffix = recipient_name.translate(_NAME_SUFFIX_TBL)
+            filename_suffix = fast_secure_filename(f"manual_{letter_type}_{i+1}_{name_suffix}_{out_ts}")
+            jobs.append((i, recipient_name, current_data_for_template, filename_suffix))
+
+        expected_bytes = estimate_batch_bytes(actual_template_to_use, len(jobs), output_format)
+        work_dir = make_work_dir(expected_bytes)
+        docx_in_memory = output_format == 'docx' and expected_bytes <= IN_MEMORY_DOCX_MAX_BYTES
+        rendered_docs = render_docx_many(actual_template_to_use, [job[2] for job in jobs])
+        batch_pdf = use_batch_pdf_conversion(output_format)
+        outcomes = []
+        for (i, recipient_name, current_data_for_template, filename_suffix), rendered in zip(jobs, rendered_docs):
+            if debug_enabled: logger.debug("--- Processing Manual %s (%s/%s): %s ---", letter_type.capitalize(), i+1, num_entries, recipient_name)
+            outcomes.append(((i, recipient_name, current_data_for_template, filename_suffix), generate_relieving_letter_web(actual_template_to_use, current_data_for_template, filename_suffix, rendered=rendered, convert_pdf=not batch_pdf, output_dir=work_dir, output_format=output_format, docx_in_memory=docx_in_memory)))
+        if batch_pdf: outcomes = apply_batch_pdf_conversion(outcomes, work_dir)
+
+        for (i, recipient_name, current_data_for_template, filename_suffix), (gen_success, docx_output, pdf_path, pdf_err_msg) in outcomes:
+
+            added_files_for_record = False
+            if gen_success:
+                 if output_format in ['docx', 'both'] and docx_output: generated_files_paths.append(docx_output); added_files_for_record = True
+                 if output_format in ['pdf', 'both']:
+                     if pdf_path:
+                         generated_files_paths.append(pdf_path); added_files_for_record = True
+                     else:
+                         pdf_failures += 1
+                         if pdf_err_msg and debug_enabled: logger.debug("PDF failure reason for '%s': %s", recipient_name, pdf_err_msg)
+                 if added_files_for_record:
+                     successful_records_count += 1
+                 else:
+                     err = f"'{recipient_name}' (Manual {letter_type.capitalize()}): DOCX generated but no requested output format found/saved."
+                     generation_errors.append(err); deferred_warnings.append(err)
+            else:
+                fail_reason = pdf_err_msg or 'Generation core function returned False.'
+                generation_errors.append(f"'{recipient_name}' (Manual {letter_type.capitalize()}): Generation failed ({fail_reason})")
+
+        if deferred_warnings: print("\n".join(f"Warning: {msg}" for msg in deferred_warnings))
+        logger.debug("Manual bulk %s finished. Success: %s/%s", letter_type, successful_records_count, num_entries)
+        if successful_records_count == 0:
+             flash(f"No {letter_type} letters generated successfully from manual entries.", "danger");
+             if generation_errors: flash("Errors: " + "; ".join(generation_errors), "warning");
+             raise ValueError("No successful generation")
+
+        logger.debug("Streaming Manual %s ZIP (%s)...", letter_type.capitalize(), output_format)
+        success_msg = f"Generated documents for {successful_records_count}/{num_entries} manual {letter_type} entries (Format: {output_format.upper()})."; flash(success_msg, 'success')
+        if generation_errors: flash("Issues: " + "; ".join(generation_errors), 'warning')
+        if pdf_failures > 0 and output_format != 'docx': flash(f"Note: PDF failed/skipped for {pdf_failures} entries.", 'info')
+        zip_filename_ts = batch_now.strftime("%Y%m%d_%H%M%S")
+        zip_filename = f"Generated_Manual_Relieving_{output_format.upper()}_{zip_filename_ts}.zip"
+        zip_response = stream_zip_response(generated_files_paths, zip_filename, cleanup_dir=work_dir, batch_time=batch_now)
+        return zip_response
+
+    except ValueError:
+        pass
+    except Exception as route_err:
+        print(f"CRITICAL Error /generate_bulk_manual_{letter_type}: {route_err}\n{traceback.format_exc()}"); flash("Unexpected server error during manual bulk generation.", "danger")
+    finally:
+        safe_cleanup(uploaded_temp_template_path_for_cleanup)
+        # work_dir (and every generated file in it) is removed by the ZIP stream once sent
+        if not zip_response:
+             if work_dir: shutil.rmtree(work_dir, ignore_errors=True)
+             return redirect(url_for('index', active_tab=active_tab_anchor))
+
+
+# General Bulk Route (CSV/JSON for Offer/Relieving)
+@app.route('/generate_bulk', methods=['POST'])
+def handle_generate_bulk():
+    uploaded_temp_template_path_for_cleanup = None
+    zip_response = None
+    work_dir = None
+    letter_type = request.form.get('letter_type')
+    source_type = request.form.get('source_type')
+    output_format = request.form.get('output_format', 'both')
+    # Determine active tab before any potential errors
+    active_tab_anchor = f'{letter_type}-{source_type}-content' if letter_type and source_type else 'index'
+
+
+    try:
+        if not letter_type or letter_type not in ['offer', 'relieving']: flash('Invalid letter type selected.', 'danger'); raise ValueError("Invalid letter type")
+        if not source_type or source_type not in ['csv', 'json']: flash('Invalid data source type selected.', 'danger'); raise ValueError("Invalid source type")
+        if output_format not in ['both', 'docx', 'pdf']: flash('Invalid output format selected.', 'danger'); raise ValueError("Invalid output format")
+
+        actual_template_to_use, uploaded_temp_template_path_for_cleanup = process_template_input(f"bulk_{letter_type}_{source_type}")
+        if not actual_template_to_use: # process_template_input flashes its own errors
+            raise ValueError("Template processing failed") # Will be caught and redirected correctly
+
+        if 'data_file' not in request.files or not request.files['data_file'].filename:
+            flash(f'No data file provided for bulk {letter_type} ({source_type}).', 'danger')
+            raise ValueError("Missing data file")
+        
+        data_file = request.files['data_file']
+        if not allowed_file(data_file.filename, ALLOWED_EXTENSIONS_DATA):
+            flash(f'Invalid data file type for {source_type}.', 'danger')
+            raise ValueError("Invalid data file type")
+        
+        file_ext = data_file.filename.rsplit('.',1)[1].lower()
+        if file_ext != source_type:
+            flash(f'Data file extension ".{file_ext}" does not match selected source type ".{source_type}".', 'danger')
+            raise ValueError("Data file type mismatch")
+
+        # --- Determine Letter-Specific Settings (CSV/JSON headers vs placeholders) ---
+        # For CSV/JSON, the data file headers/keys become the *template placeholders* directly.
+        # The `name_key_in_data` is the specific header/key in the CSV/JSON that holds the recipient's name.
+        # The `name_ph_for_filename` is the *placeholder form* of that name key, used for messages/filenames if needed.
+        if letter_type == 'offer': 
+            name_key_in_data = 'candidate name' # Expected header in CSV/JSON for recipient's name
+            name_ph_for_filename = '{candidate name}' 
+            file_prefix = "Offer_Letter"
+            gen_func = generate_offer_letter_web
+        else: # relieving
+            name_key_in_data = 'name' # Expected header in CSV/JSON for recipient's name
+            name_ph_for_filename = '{name}'
+            file_prefix = "Relieving_Letter"
+            gen_func = generate_relieving_letter_web
+        
+        records = []; logger.debug("Processing %s data for %s...", source_type.upper(), letter_type.upper());
+        try:
+            if source_type == 'csv':
+                 # Stream the upload row by row; headers (stripped, original case) become the placeholders
+                 csv_text = io.TextIOWrapper(data_file.stream, encoding='utf-8-sig', newline='')
+                 reader = csv.reader(csv_text)
+                 fieldnames = next(reader, None)
+                 if not fieldnames:
+                     raise ValueError("CSV file has no header row.")
+                 original_headers = [str(h).strip() for h in fieldnames]
+                 # Check if the primary name key (normalized) exists in CSV headers
+                 if name_key_in_data.lower().strip() not in [h.lower() for h in original_headers]:
+                     raise ValueError(f"Missing required column header: '{name_key_in_data}' in CSV.")
+
+                 csv_rows = None
+                 if _stream_size(data_file.stream) > ARROW_CSV_MIN_BYTES:
+                     csv_rows = read_csv_rows_arrow(data_file.stream, fieldnames)
+                 if csv_rows is None:
+                     csv_rows = reader
+
+                 # Placeholder is {Original CSV Header}; built once, then zipped with each row's cells
+                 placeholder_keys = [f"{{{h}}}" for h in original_headers]
+                 width = len(placeholder_keys)
+                 for row in csv_rows:
+                     if not row: continue # Blank line
+                     if len(row) < width: row = list(row) + [''] * (width - len(row)) # Missing trailing cells read as ''
+                     records.append({key: cell.strip() for key, cell in zip(placeholder_keys, row)})
+
+            elif source_type == 'json':
+                 raw_records_list = json_loads(data_file.stream.read()) # Parsed straight from the upload; no temp copy
+                 if not isinstance(raw_records_list, list): raise ValueError("JSON data must be a list of objects.")
+                 for obj_idx, raw_obj_dict in enumerate(raw_records_list):
+                      if not isinstance(raw_obj_dict, dict): raise ValueError(f"JSON list item at index {obj_idx} must be an object.")
+                      
+                      # Check for name key (case-insensitive for robustness)
+                      found_name_key_original_case = None
+                      for k_obj in raw_obj_dict.keys():
+                          if str(k_obj).strip().lower() == name_key_in_data.lower().strip():
+                              found_name_key_original_case = k_obj; break
+                      if not found_name_key_original_case:
+                          raise ValueError(f"JSON object at index {obj_idx} is missing the required key: '{name_key_in_data}'.")
+
+                      # JSON keys are used directly as placeholder keys (wrapped in {})
+                      template_data = {f"{{{str(k).strip()}}}": normalize_value(v) for k, v in raw_obj_dict.items()}
+                      records.append(template_data)
+
+            if not records: flash("No valid records found in data file.", "warning"); raise ValueError("No records")
+
+        except Exception as parse_err: flash(f"Error parsing {source_type.upper()} data: {parse_err}", 'danger'); raise
+
+        # --- Generation Loop ---
+        generated_files_paths = []; gen_errors = []; pdf_fails = 0; success_count = 0; total_records = len(records); jobs = []
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
+        if output_format in ['pdf', 'both'] and not pdf_conversion_available(): flash("PDF conversion unavailable.", "warning")
+        
+        batch_now = datetime.datetime.now() # One clock read per request: entry names and the ZIP name share it
+        ts_suffix = batch_now.strftime('%H%M%S%f') # The entry index keeps names unique; work_dir is private to this request
+
+        # The name placeholder is {Original CSV Header} / {Original JSON key} matching `name_key_in_data`
+        # case-insensitively. It is resolved once from the first record; every CSV row shares those keys,
+        # and only JSON objects whose keys differ from the first one fall back to the per-record scan.
+        normalized_name_key_in_data = name_key_in_data.lower().strip()
+        def find_name_placeholder(record):
+            return next((ph_key for ph_key in record if ph_key[1:-1].lower() == normalized_name_key_in_data), None)
+        name_ph = find_name_placeholder(records[0])
+
+        for i, record_data_for_template in enumerate(records):
+            record_name_ph = name_ph if name_ph in record_data_for_template else find_name_placeholder(record_data_for_template)
+            recipient_name_from_record = record_data_for_template[record_name_ph] if record_name_ph else ''
+
+            if not recipient_name_from_record: 
+                gen_errors.append(f"Record {i+1}: Missing or empty value for the name key ('{name_key_in_data}') in the {source_type.upper()} data."); continue;
+
+            suffix_name = recipient_name_from_record.translate(_NAME_SUFFIX_TBL)
+            fname_suffix = fast_secure_filename(f"bulk_{letter_type}_{source_type}_{i+1}_{suffix_name}_{ts_suffix}")
+            jobs.append((i, recipient_name_from_record, record_data_for_template, fname_suffix))
+
+        expected_bytes = estimate_batch_bytes(actual_template_to_use, len(jobs), output_format)
+        work_dir = make_work_dir(expected_bytes)
+        docx_in_memory = output_format == 'docx' and expected_bytes <= IN_MEMORY_DOCX_MAX_BYTES
+        rendered_docs = render_docx_many(actual_template_to_use, [job[2] for job in jobs])
+        batch_pdf = use_batch_pdf_conversion(output_format)
+        outcomes = []
+        for (i, recipient_name_from_record, record_data_for_template, fname_suffix), rendered in zip(jobs, rendered_docs):
+            if debug_enabled: logger.debug("--- Processing Bulk %s (%s) (%s/%s): %s ---", letter_type.upper(), source_type.upper(), i+1, total_records, recipient_name_from_record)
+            outcomes.append(((i, recipient_name_from_record, record_data_for_template, fname_suffix), gen_func(actual_template_to_use, record_data_for_template, fname_suffix, rendered=rendered, convert_pdf=not batch_pdf, output_dir=work_dir, output_format=output_format, docx_in_memory=docx_in_memory)))
+        if batch_pdf: outcomes = apply_batch_pdf_conversion(outcomes, work_dir)
+
+        for (i, recipient_name_from_record, record_data_for_template, fname_suffix), (success, docx_out, pdf_p, pdf_err) in outcomes:
+
+            added = False
+            if success:
+                if output_format in ['docx','both'] and docx_out: generated_files_paths.append(docx_out); added = True
+                if output_format in ['pdf','both']:
+                    if pdf_p: generated_files_paths.append(pdf_p); added = True
+                    else: pdf_fails += 1;
+                if added: success_count += 1
+                else: gen_errors.append(f"'{recipient_name_from_record}': DOCX generated but no requested output format found/saved.")
+            else: gen_errors.append(f"'{recipient_name_from_record}': Failed ({pdf_err or 'Unknown generation error'})")
+
+        logger.debug("Bulk %s (%s) finished. Success: %s/%s", letter_type, source_type, success_count, total_records);
+        if success_count == 0:
+            flash(f"No {letter_type} documents generated successfully from {source_type} data.", "danger");
+            if gen_errors: flash("Errors: "+"; ".join(gen_errors), "warning");
+            raise ValueError("No successful generation")
+
+        logger.debug("Streaming ZIP (%s) for %s from %s...", output_format, letter_type, source_type)
+        flash(f"Generated {success_count}/{total_records} {letter_type} documents from {source_type} (Format: {output_format.upper()}).", 'success')
+        if gen_errors: flash("Issues: "+"; ".join(gen_errors), 'warning')
+        if pdf_fails > 0 and output_format != 'docx': flash(f"Note: PDF failed/skipped for {pdf_fails} record(s).", 'info')
+        zip_ts = batch_now.strftime("%Y%m%d_%H%M%S"); zip_fname = f"Generated_{file_prefix}s_{source_type.upper()}_{output_format.upper()}_{zip_ts}.zip"
+        zip_response = stream_zip_response(generated_files_paths, zip_fname, cleanup_dir=work_dir, batch_time=batch_now)
+        return zip_response
+
+    except ValueError: 
+        pass 
+    except Exception as route_err:
+        print(f"CRITICAL Error /generate_bulk ({letter_type}/{source_type}): {route_err}\n{traceback.format_exc()}")
+        flash(f"Unexpected server error during bulk {letter_type} generation from {source_type}.", "danger")
+    finally:
+        safe_cleanup(uploaded_temp_template_path_for_cleanup)
+        # work_dir (and every generated file in it) is removed by the ZIP stream once sent
+        if not zip_response:
+             if work_dir: shutil.rmtree(work_dir, ignore_errors=True)
+             return redirect(url_for('index', active_tab=active_tab_anchor))
+
+
+# --- DOCX to PDF Converter Route ---
+@app.route('/convert_to_pdf', methods=['POST'])
+def handle_convert_to_pdf():
+    active_tab_anchor = 'converter-content'
+    if not pdf_conversion_available(): flash("PDF conversion capability unavailable on server.", "danger"); return redirect(url_for('index', active_tab=active_tab_anchor))
+    if 'docx_file' not in request.files: flash('No DOCX file provided.', 'danger'); return redirect(url_for('index', active_tab=active_tab_anchor))
+    file = request.files['docx_file']; original_filename = file.filename
+    if original_filename == '': flash('No file selected.', 'danger'); return redirect(url_for('index', active_tab=active_tab_anchor))
+    if not allowed_file(original_filename, ALLOWED_EXTENSIONS_DOCX): flash('Invalid file type (.docx required).', 'danger'); return redirect(url_for('index', active_tab=active_tab_anchor))
+    
+    temp_docx_path = None; generated_pdf_path = None
+    try:
+        safe_base = fast_secure_filename(os.path.splitext(original_filename)[0]); ts = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
+        unique_suffix = f"{safe_base}_{ts}"
+        gen_fn = f"converted_{unique_suffix}.pdf"; generated_pdf_path = os.path.join(app.config['GENERATED_FOLDER'], gen_fn)
+
+        logger.debug("Converting %s...", original_filename)
+        pdf_bytes = None
+        if SOFFICE_POOL_AVAILABLE:
+            # Bytes in, bytes out over the warm worker; no temporary DOCX on disk
+            try:
+                pdf_bytes = convert_via_uno(file.read())
+            except ConnectionError: # Pool unreachable and now disabled; convert from a temporary file below
+                file.stream.seek(0)
+        if pdf_bytes is not None:
+            with open(generated_pdf_path, 'wb') as f: f.write(pdf_bytes)
+        else:
+            temp_fn = f"upload_convert_in_{unique_suffix}.docx"; temp_docx_path = os.path.join(app.config['UPLOAD_FOLDER'], temp_fn)
+            file.save(temp_docx_path, buffer_size=UPLOAD_COPY_BUFFER)
+            convert_docx_to_pdf(temp_docx_path, generated_pdf_path)
+        if not os.path.exists(generated_pdf_path): raise RuntimeError("Conversion process completed, but the output PDF file was not found.")
+
+        print(f"✅ Conversion successful: {gen_fn}"); flash(f"Successfully converted '{original_filename}' to PDF.", 'success')
+        return redirect(url_for('index', 
+                                converter_pdf_download=gen_fn, 
+                                original_docx_filename=original_filename, 
+                                active_tab=active_tab_anchor))
+    except Exception as e:
+        error_msg = f"Conversion failed for '{original_filename}': {str(e)}"; print(f"❌ Error in /convert_to_pdf: {e}\n{traceback.format_exc()}"); flash(error_msg, 'danger'); 
+        safe_cleanup(generated_pdf_path); 
+        return redirect(url_for('index', active_tab=active_tab_anchor))
+    finally: 
+        safe_cleanup(temp_docx_path)
+
+
+# --- Download Route ---
+@app.route('/download/<path:filename>')
+def download_file(filename):
+    safe_basename = fast_secure_filename(filename)
+    if not safe_basename or len(safe_basename) < 3:
+        flash("Invalid download filename requested.", "danger")
+        return redirect(url_for('index'))
+
+    generated_dir = app.config['GENERATED_FOLDER']
+    logger.debug("Download request for '%s' from '%s'", safe_basename, generated_dir)
+    
+    target_path = os.path.join(generated_dir, safe_basename)
+    # Path traversal check; the sanitized name has no separators, so only names containing '..' need resolving
+    if '..' in safe_basename and os.path.commonpath([os.path.realpath(target_path), GENERATED_ABS]) != GENERATED_ABS:
+        flash("Attempted to access file outside designated area.", "danger")
+        print(f"SECURITY WARNING: Path traversal attempt for filename: {filename}")
+        return redirect(url_for('index'))
+
+    if X_ACCEL_REDIRECT_PREFIX:
+        # nginx streams the file itself (sendfile), so no bytes pass through Python
+        response = Response(mimetype=mimetypes.guess_type(safe_basename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + safe_basename
+        response.headers['Content-Disposition'] = f'attachment; filename="{safe_basename}"'
+        return response
+
+    try:
+        return send_from_directory(
+            generated_dir,
+            safe_basename,
+            as_attachment=True
+        )
+    except FileNotFoundError:
+         print(f"Error: Download file not found: {target_path}")
+         flash(f"Sorry, the requested file '{safe_basename}' could not be found on the server.", "warning")
+         return redirect(url_for('index'))
+    except Exception as e:
+         print(f"Error during download processing for '{safe_basename}': {e}")
+         flash("An error occurred while preparing the file for download.", "danger")
+         return redirect(url_for('index'))
+
+
+# === Run the App ===
+if __name__ == "__main__":
+    print("--- Starting BKM Document Tools ---")
+    is_debug_mode = os.environ.get("FLASK_DEBUG", "1") == "1" # Default to debug if not set
+    app.debug = is_debug_mode
+    logging.basicConfig(level=logging.DEBUG if app.debug else logging.INFO, format="%(levelname)s: %(message)s")
+
+    print(f" * Environment: {'development' if app.debug else 'production'}")
+    print(f" * Debug mode: {app.debug}")
+    print(f" * Upload folder: {app.config['UPLOAD_FOLDER']}")
+    print(f" * Generated files folder: {app.config['GENERATED_FOLDER']}")
+    print(f" * User templates folder: {app.config['TEMPLATES_FOLDER']}")
+    print(f" * PDF Conversion Available: {pdf_conversion_available()}")
+    print(f" * soffice Worker Pool: {'enabled (' + str(SOFFICE_POOL_SIZE) + ' workers)' if SOFFICE_POOL_AVAILABLE else 'disabled'}")
+    if not app.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true": # Only in the serving process, not the reloader
+        warm_soffice_pool()
+    host_addr = os.environ.get("FLASK_RUN_HOST", '0.0.0.0')
+    port_num = int(os.environ.get("FLASK_RUN_PORT", 5000))
+    print(f" * Running on http://{host_addr}:{port_num} (Press CTRL+C to quit)")
+    
+    if app.debug:
+        app.run(host=host_addr, port=port_num)
+    else:
+        # Waitress hands file responses to wsgi.file_wrapper, which uses sendfile where available
+        try:
+            from waitress import serve
+            print(" * Serving with waitress")
+            serve(app, host=host_addr, port=port_num)
+        except ImportError:
+            print("⚠️ WARNING: `waitress` not installed; falling back to the Flask development server.")
+            app.run(host=host_addr, port=port_num)
\ No newline at end of file